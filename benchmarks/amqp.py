@@ -0,0 +1,131 @@
+# SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+"""Benchmark of the per-message overhead of dispatching AMQP messages.
+
+Compares the CPU time per message of resolving a typical callback's
+dependencies:
+
+* `uncached`: FastAPI's `solve_dependencies`, with the dependencies analysed
+  for every message, as `AbstractAMQPSystem._on_message` did originally.
+* `cached`: FastAPI's `solve_dependencies`, with the dependencies analysed once.
+* `plan`: the compiled execution plan of `dependency_injected_with_deps`.
+
+    python -m benchmarks.amqp -o results.json
+"""
+
+import asyncio
+import json
+import platform
+import sys
+import time
+from collections.abc import Awaitable
+from collections.abc import Callable
+from contextlib import AsyncExitStack
+from importlib.metadata import version
+from types import SimpleNamespace
+from typing import Any
+
+import click
+from fastapi import Depends
+from fastapi import Request
+from fastapi.dependencies.utils import get_dependant
+from fastapi.dependencies.utils import solve_dependencies
+
+from fastramqpi.ramqp.depends import Context
+from fastramqpi.ramqp.depends import Message
+from fastramqpi.ramqp.depends import PayloadBytes
+from fastramqpi.ramqp.depends import RoutingKey
+from fastramqpi.ramqp.depends import dependency_injected_with_deps
+from fastramqpi.ramqp.depends import from_context
+
+
+async def callback(
+    message: Message,
+    routing_key: RoutingKey,
+    payload: PayloadBytes,
+    context: Context,
+    database: Any = Depends(from_context("database")),
+) -> None:
+    """Callback with the dependencies of a typical integration."""
+
+
+def cached() -> Callable[..., Awaitable]:
+    """Resolve through a fake Request and FastAPI's `solve_dependencies`."""
+    dependant = get_dependant(path="", call=callback)
+
+    async def handle(message: Any, context: Any) -> Any:
+        async with AsyncExitStack() as stack:
+            request = Request(
+                {
+                    "type": "http",
+                    "headers": [],
+                    "query_string": "",
+                    "state": {
+                        "context": context,
+                        "message": message,
+                        "callback": callback,
+                    },
+                }
+            )
+            solved = await solve_dependencies(
+                request=request,
+                dependant=dependant,
+                dependency_overrides_provider=None,
+                async_exit_stack=stack,
+                embed_body_fields=False,
+            )
+            return await callback(**solved.values)
+
+    return handle
+
+
+def uncached() -> Callable[..., Awaitable]:
+    async def handle(**kwargs: Any) -> Any:
+        return await cached()(**kwargs)
+
+    return handle
+
+
+def plan() -> Callable[..., Awaitable]:
+    return dependency_injected_with_deps(callback, [])
+
+
+async def measure(handler: Callable[..., Awaitable], number: int) -> float:
+    message = SimpleNamespace(routing_key="person", body=b'"uuid"')
+    context = {"database": object()}
+    start = time.process_time()
+    for _ in range(number):
+        await handler(message=message, context=context)
+    return (time.process_time() - start) / number
+
+
+@click.command()
+@click.option("--number", default=10_000, help="Messages per measurement.")
+@click.option("--repeat", default=5, help="Measurements; the fastest is reported.")
+@click.option("--output", "-o", type=click.File("w"), help="Write JSON results.")
+def cli(number: int, repeat: int, output: Any) -> None:
+    results = {}
+    variants = [("uncached", uncached), ("cached", cached), ("plan", plan)]
+    for name, build in variants:
+        handler = build()
+        results[name] = min(
+            asyncio.run(measure(handler, number)) for _ in range(repeat)
+        )
+        click.echo(f"{name:<9} {results[name] * 1e6:8.3f} µs/message")
+    click.echo(f"speedup {results['uncached'] / results['plan']:.1f}x")
+    if output is not None:
+        report = {
+            "benchmark": "amqp",
+            "fastramqpi": version("fastramqpi"),
+            "python": sys.version,
+            "platform": platform.platform(),
+            "parameters": {"number": number, "repeat": repeat},
+            "results": {
+                f"{name}_seconds_per_message": s for name, s in results.items()
+            },
+        }
+        json.dump(report, output, indent=2)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,150 @@
+# SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+"""Benchmark of the GraphQL events pipeline.
+
+Drains a backlog of events from a fake OS2mo, through the event fetchers and
+a no-op handler in the integration, for each level of parallelism:
+
+    python -m benchmarks.events --parallelism 1 --parallelism 8 -o results.json
+
+For each run, it reports the throughput, the p50/p99 latency from fetching an
+event to acknowledging it, and the number of GraphQL requests to OS2mo per
+event. The results are written as JSON, together with the parameters and
+versions, so they can be compared between releases.
+"""
+
+import asyncio
+import json
+import platform
+import statistics
+import sys
+import time
+from importlib.metadata import version
+from typing import Any
+
+import click
+from fastapi import FastAPI
+
+from fastramqpi.config import Settings
+from fastramqpi.events import Event
+from fastramqpi.events import GraphQLEvents
+from fastramqpi.events import Listener
+from fastramqpi.events import lifespan
+from fastramqpi.events_fake import FakeMO
+from fastramqpi.logging import configure_logging
+
+
+async def run(
+    events: int,
+    parallelism: int,
+    batch_size: int,
+    prefetch: int,
+    mo_latency: float,
+    handler_latency: float,
+) -> dict[str, Any]:
+    """Drain a backlog of `events` events with the given listener settings."""
+    settings = Settings(client_id="benchmark", client_secret="benchmark")
+    fake = FakeMO(latency=mo_latency, backlog=events)
+    app = FastAPI()
+
+    @app.post("/handler")
+    async def handler(event: Event[str]) -> None:
+        if handler_latency:
+            await asyncio.sleep(handler_latency)
+
+    graphql_events = GraphQLEvents(
+        declare_listeners=[
+            Listener(
+                namespace="mo",
+                user_key="benchmark",
+                routing_key="benchmark",
+                path="/handler",
+                parallelism=parallelism,
+                batch_size=batch_size,
+                prefetch=prefetch,
+            )
+        ],
+        in_process_dispatch=True,
+    )
+    async with lifespan(settings, fake.client(), graphql_events, app):
+        requests = fake.requests  # exclude the declaration
+        start = time.monotonic()
+        while fake.acknowledged < events:
+            await asyncio.sleep(0.001)
+        seconds = time.monotonic() - start
+        requests = fake.requests - requests
+
+    percentiles = statistics.quantiles(fake.latencies, n=100)
+    return {
+        "parallelism": parallelism,
+        "seconds": seconds,
+        "events_per_second": events / seconds,
+        "latency_p50": percentiles[49],
+        "latency_p99": percentiles[98],
+        "mo_requests_per_event": requests / events,
+    }
+
+
+@click.command()
+@click.option("--events", default=2000, help="Number of events per run.")
+@click.option(
+    "parallelisms",
+    "--parallelism",
+    multiple=True,
+    type=int,
+    default=[1, 2, 4, 8, 16],
+    help="Listener parallelism to benchmark. Can be given multiple times.",
+)
+@click.option("--batch-size", default=1, help="Listener batch size.")
+@click.option("--prefetch", default=0, help="Listener prefetch.")
+@click.option("--mo-latency", default=0.005, help="Seconds per OS2mo request.")
+@click.option("--handler-latency", default=0.0, help="Seconds per handler call.")
+@click.option("--output", "-o", type=click.File("w"), help="Write JSON results.")
+def cli(
+    events: int,
+    parallelisms: tuple[int, ...],
+    batch_size: int,
+    prefetch: int,
+    mo_latency: float,
+    handler_latency: float,
+    output: Any,
+) -> None:
+    configure_logging("WARNING", json_logs=False)
+    results = []
+    for parallelism in parallelisms:
+        result = asyncio.run(
+            run(
+                events=events,
+                parallelism=parallelism,
+                batch_size=batch_size,
+                prefetch=prefetch,
+                mo_latency=mo_latency,
+                handler_latency=handler_latency,
+            )
+        )
+        click.echo(
+            "parallelism={parallelism:<3} {events_per_second:8.1f} events/s"
+            "  p50={latency_p50:.4f}s  p99={latency_p99:.4f}s"
+            "  requests/event={mo_requests_per_event:.2f}".format(**result)
+        )
+        results.append(result)
+    if output is not None:
+        report = {
+            "benchmark": "events",
+            "fastramqpi": version("fastramqpi"),
+            "python": sys.version,
+            "platform": platform.platform(),
+            "parameters": {
+                "events": events,
+                "batch_size": batch_size,
+                "prefetch": prefetch,
+                "mo_latency": mo_latency,
+                "handler_latency": handler_latency,
+            },
+            "results": results,
+        }
+        json.dump(report, output, indent=2)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,62 @@
+# SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+"""Benchmark of serializing GraphQL events for delivery to the integration.
+
+Compares the CPU time per event of building the `Event` model and encoding it
+with `jsonable_encoder` and `json.dumps`, as was done before, with the
+fast-path `encode_event`:
+
+    python -m benchmarks.serialize -o results.json
+"""
+
+import json
+import platform
+import sys
+import timeit
+from importlib.metadata import version
+from typing import Any
+
+import click
+from fastapi.encoders import jsonable_encoder
+
+from fastramqpi.autogenerated_graphql_client import FetchEventEventFetch
+from fastramqpi.events import Event
+from fastramqpi.events import encode_event
+
+
+def encode_event_model(event: FetchEventEventFetch) -> bytes:
+    """Serialize an event through the generic model, like HTTPX's `json=`."""
+    payload = jsonable_encoder(Event(subject=event.subject, priority=event.priority))
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+@click.command()
+@click.option("--number", default=100_000, help="Events per measurement.")
+@click.option("--repeat", default=5, help="Measurements; the fastest is reported.")
+@click.option("--output", "-o", type=click.File("w"), help="Write JSON results.")
+def cli(number: int, repeat: int, output: Any) -> None:
+    event = FetchEventEventFetch(
+        subject="c5e8e0a1-8c5b-4b6a-9f1e-3f5f6a1f0e2d", priority=10000, token="t"
+    )
+    results = {}
+    for name, encode in [("model", encode_event_model), ("fast", encode_event)]:
+        seconds = min(
+            timeit.repeat(lambda: encode(event), number=number, repeat=repeat)
+        )
+        results[name] = seconds / number
+        click.echo(f"{name:<6} {results[name] * 1e6:8.3f} µs/event")
+    click.echo(f"speedup {results['model'] / results['fast']:.1f}x")
+    if output is not None:
+        report = {
+            "benchmark": "serialize",
+            "fastramqpi": version("fastramqpi"),
+            "python": sys.version,
+            "platform": platform.platform(),
+            "parameters": {"number": number, "repeat": repeat},
+            "results": {f"{name}_seconds_per_event": s for name, s in results.items()},
+        }
+        json.dump(report, output, indent=2)
+
+
+if __name__ == "__main__":
+    cli()
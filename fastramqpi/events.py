@@ -1,9 +1,25 @@
 # SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
 # SPDX-License-Identifier: MPL-2.0
 import asyncio
+import heapq
+import itertools
+import random
+import sqlite3
+import time
+import zlib
+from collections.abc import Awaitable
+from collections.abc import Callable
+from collections.abc import Iterable
 from contextlib import asynccontextmanager
+from contextlib import suppress
 from dataclasses import dataclass
 from dataclasses import field
+from datetime import datetime
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+from functools import partial
+from json.encoder import encode_basestring
+from typing import Any
 from typing import AsyncIterator
 from typing import Generic
 from typing import TypeVar
@@ -11,13 +27,19 @@ from uuid import UUID
 from uuid import uuid4
 
 import structlog
-from fastapi.encoders import jsonable_encoder
+from fastapi import FastAPI
+from httpx import ASGITransport
 from httpx import AsyncClient
+from httpx import AsyncHTTPTransport
 from httpx import ConnectError
 from httpx import HTTPStatusError
+from httpx import Limits
+from more_itertools import unique_everseen
 from pydantic.generics import GenericModel
 from structlog.contextvars import bound_contextvars
 
+from . import events_metrics as metrics
+from .autogenerated_graphql_client import FetchEventEventFetch
 from .autogenerated_graphql_client import GraphQLClient
 from .autogenerated_graphql_client import ListenerCreateInput
 from .autogenerated_graphql_client import NamespaceCreateInput
@@ -29,9 +51,14 @@ T = TypeVar("T")
 
 logger = structlog.stdlib.get_logger()
 
-# Define globally to allow overwriting sleep duration during testing
+# Define globally to allow overwriting sleep duration during testing. This is
+# the longest a fetcher will back off when no events are available, unless the
+# listener configures otherwise.
 NO_EVENT_SLEEP_DURATION = 5.0
 
+# Seconds between autoscaling adjustments of the number of fetchers
+AUTOSCALE_INTERVAL = 10.0
+
 
 @dataclass(frozen=True)
 class Namespace:
@@ -56,6 +83,79 @@ class Listener:
     routing_key: str
     path: str
     parallelism: int = 1
+    # Number of events each fetcher fetches from OS2mo per GraphQL request.
+    # Fetched events cannot be fetched by anyone else until they are
+    # acknowledged or OS2mo's retry delay expires, so the batch should be small
+    # enough to be handled well within that delay.
+    batch_size: int = 1
+    # Number of fetched events each fetcher buffers ahead of delivery, allowing
+    # fetching and acknowledging to overlap with handling. When zero, a fetcher
+    # only fetches the next batch once the previous one has been handled and
+    # acknowledged, so it never has more than one batch in flight.
+    prefetch: int = 0
+    # While no events are available, a single fetcher polls on behalf of all
+    # fetchers of the listener, backing off exponentially from `min_idle_sleep`
+    # to `max_idle_sleep` seconds between polls. All fetchers return to polling
+    # without delay as soon as an event is fetched. The maximum defaults to
+    # `NO_EVENT_SLEEP_DURATION`.
+    min_idle_sleep: float = 0.1
+    max_idle_sleep: float | None = None
+    # Events handled by any of the listener's fetchers are acknowledged together
+    # in a single GraphQL request once `acknowledge_batch_size` tokens have been
+    # collected, or `acknowledge_interval` seconds after the first one was.
+    acknowledge_batch_size: int = 100
+    acknowledge_interval: float = 0.05
+    # Autoscale the number of fetchers between `parallelism` and
+    # `max_parallelism` based on the backlog, handler latency, and rate-limiting.
+    max_parallelism: int | None = None
+    # Deliver at most this many events per second to the integration, across
+    # all fetchers of the listener, allowing bursts of up to one second's worth.
+    max_events_per_second: float | None = None
+    # Share of the integration's handler capacity given to the listener, relative
+    # to the other listeners, when `GraphQLEvents.max_concurrent_deliveries` is
+    # reached. See `DeliveryScheduler`.
+    weight: float = 1.0
+    # Coalesce events for a subject which is already waiting to be delivered
+    # into the pending delivery, whose success acknowledges all of them. This
+    # saves the integration from handling the same object over and over during
+    # bulk edits in OS2mo.
+    coalesce: bool = False
+    # Deliver all events for a subject one at a time, in the order they were
+    # fetched, by routing them to a fixed deliverer by the hash of the subject.
+    # The listener gets `max_parallelism` (or `parallelism`) deliverers, which
+    # are fed by its fetchers.
+    serialize_subjects: bool = False
+    # Park an event in the dead-letter store, and acknowledge it, once the
+    # integration's handler has failed it this many times in a row. Poison
+    # events are otherwise redelivered forever, wasting a fetcher each time.
+    # Failures caused by rate-limiting or connection errors do not count.
+    # Requires `GraphQLEvents.dead_letter_database`.
+    dead_letter_threshold: int | None = None
+
+    def __post_init__(self) -> None:
+        if self.batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        if self.prefetch < 0:
+            raise ValueError("prefetch must not be negative")
+        if self.min_idle_sleep < 0:
+            raise ValueError("min_idle_sleep must not be negative")
+        if (
+            self.max_idle_sleep is not None
+            and self.max_idle_sleep < self.min_idle_sleep
+        ):
+            raise ValueError("max_idle_sleep must be at least min_idle_sleep")
+        if self.acknowledge_batch_size < 1:
+            raise ValueError("acknowledge_batch_size must be at least 1")
+        if self.acknowledge_interval < 0:
+            raise ValueError("acknowledge_interval must not be negative")
+        if self.max_parallelism is not None and self.max_parallelism < self.parallelism:
+            raise ValueError("max_parallelism must be at least parallelism")
+        if self.max_events_per_second is not None and self.max_events_per_second <= 0:
+            raise ValueError("max_events_per_second must be positive")
+        if self.weight <= 0:
+            raise ValueError("weight must be positive")
+        if self.dead_letter_threshold is not None and self.dead_letter_threshold < 1:
+            raise ValueError("dead_letter_threshold must be at least 1")
 
 
 @dataclass(frozen=True)
@@ -64,6 +164,36 @@ class GraphQLEvents:
 
     declare_namespaces: list[Namespace] = field(default_factory=list)
     declare_listeners: list[Listener] = field(default_factory=list)
+    # Deliver events to the integration's handlers in-process through its ASGI
+    # application, instead of over HTTP through the integration's own port.
+    in_process_dispatch: bool = False
+    # Maximum number of events delivered to the integration at the same time,
+    # across all listeners. Once reached, deliveries are scheduled by event
+    # priority and listener weight.
+    max_concurrent_deliveries: int | None = None
+    # Seconds to wait on shutdown for the fetchers to finish delivering and
+    # acknowledging the events they already fetched, before cancelling them.
+    drain_timeout: float = 30.0
+    # Talk HTTP/2 to the integration, with prior knowledge, instead of HTTP/1.1.
+    # Requires the `h2` package (`httpx[http2]`), and an ASGI server which
+    # supports it, such as hypercorn.
+    http2: bool = False
+    # Connect to the integration through this Unix domain socket, instead of
+    # through its TCP port, e.g. when serving with `uvicorn --uds`.
+    integration_uds: str | None = None
+    # SQLite database of dead-lettered events, required if any listener has a
+    # `dead_letter_threshold`. Dead-lettered events are acknowledged in OS2mo, so
+    # the database must be a file on a persistent volume, or they are lost on
+    # restart.
+    dead_letter_database: str | None = None
+
+    def __post_init__(self) -> None:
+        if self.max_concurrent_deliveries is not None and (
+            self.max_concurrent_deliveries < 1
+        ):
+            raise ValueError("max_concurrent_deliveries must be at least 1")
+        if self.drain_timeout < 0:
+            raise ValueError("drain_timeout must not be negative")
 
 
 class Event(GenericModel, Generic[T], frozen=True):
@@ -73,17 +203,671 @@ class Event(GenericModel, Generic[T], frozen=True):
     priority: int
 
 
-async def fetcher(
+@dataclass
+class IdleBackoff:
+    """Exponential backoff, with jitter, for polling OS2mo while idle."""
+
+    minimum: float
+    maximum: float
+    delay: float = field(default=0.0, init=False)
+
+    def reset(self) -> None:
+        """Return to polling without delay."""
+        self.delay = 0.0
+
+    def next_delay(self) -> float:
+        """Get the time to sleep before the next poll, and increase the backoff.
+
+        The delay is jittered to avoid fetchers polling in lockstep.
+        """
+        self.delay = min(max(self.delay * 2, self.minimum), self.maximum)
+        return random.uniform(self.delay / 2, self.delay)
+
+
+async def fetch_events(
+    graphql_client: GraphQLClient, listener: UUID, limit: int
+) -> list[FetchEventEventFetch]:
+    """Fetch up to `limit` events for the listener in a single GraphQL request.
+
+    OS2mo's `event_fetch` returns at most one event, so multiple events are
+    fetched by aliasing the field once for each requested event.
+    """
+    if limit == 1:
+        event = await graphql_client.fetch_event(listener)
+        return [event] if event is not None else []
+    fields = "\n".join(
+        f"e{i}: event_fetch(filter: {{listener: $listener}}) "
+        "{ subject priority token }"
+        for i in range(limit)
+    )
+    query = f"query FetchEvents($listener: UUID!) {{\n{fields}\n}}"
+    response = await graphql_client.execute(
+        query=query, variables={"listener": listener}
+    )
+    data = graphql_client.get_data(response)
+    events = (
+        FetchEventEventFetch.parse_obj(data[f"e{i}"])
+        for i in range(limit)
+        if data[f"e{i}"] is not None
+    )
+    # The aliased fields are resolved independently, so guard against OS2mo
+    # handing out the same event more than once.
+    return list(unique_everseen(events, key=lambda event: str(event.token)))
+
+
+async def acknowledge_events(graphql_client: GraphQLClient, tokens: list[Any]) -> None:
+    """Acknowledge events in a single GraphQL request."""
+    if len(tokens) == 1:
+        await graphql_client.acknowledge_event(tokens[0])
+        return
+    arguments = ", ".join(f"$t{i}: EventToken!" for i in range(len(tokens)))
+    fields = "\n".join(
+        f"a{i}: event_acknowledge(input: {{token: $t{i}}})" for i in range(len(tokens))
+    )
+    query = f"mutation AcknowledgeEvents({arguments}) {{\n{fields}\n}}"
+    response = await graphql_client.execute(
+        query=query, variables={f"t{i}": token for i, token in enumerate(tokens)}
+    )
+    graphql_client.get_data(response)
+
+
+class Acknowledger:
+    """Acknowledge the events handled by all fetchers of a listener in batches.
+
+    Tokens are flushed in a single GraphQL request when `max_size` tokens have
+    been collected, `interval` seconds after the first token was collected, or
+    as soon as someone waits for the flush through `join()` or `wait()`.
+    """
+
+    def __init__(
+        self,
+        graphql_client: GraphQLClient,
+        max_size: int,
+        interval: float,
+        user_key: str = "",
+    ) -> None:
+        self.graphql_client = graphql_client
+        # Listener user_key for metrics
+        self.user_key = user_key
+        self.max_size = max_size
+        self.interval = interval
+        self.queue: asyncio.Queue[Any] = asyncio.Queue()
+        self.flush_requested = asyncio.Event()
+        # Tokens taken from the queue, but not yet sent to OS2mo
+        self.batch: list[Any] = []
+        self.flushing: asyncio.Task | None = None
+        # Resolved when the token has been flushed, or forgotten, for `wait()`
+        self.flushed: dict[Any, asyncio.Future[None]] = {}
+
+    def expect(self, token: Any) -> asyncio.Future[None]:
+        """Track the event with the given token from before it is scheduled.
+
+        Returns:
+            A future resolved once the token has been flushed, or forgotten.
+        """
+        return self.flushed.setdefault(
+            token, asyncio.get_running_loop().create_future()
+        )
+
+    def forget(self, tokens: Iterable[Any]) -> None:
+        """Stop tracking events which will not be acknowledged, e.g. failures."""
+        for token in tokens:
+            flushed = self.flushed.pop(token, None)
+            if flushed is not None and not flushed.done():
+                flushed.set_result(None)
+
+    def put(self, token: Any) -> None:
+        """Schedule the event with the given token for acknowledgement."""
+        self.expect(token)
+        self.queue.put_nowait(token)
+        if self.queue.qsize() >= self.max_size:
+            self.flush_requested.set()
+
+    async def join(self) -> None:
+        """Flush now, and wait until all scheduled tokens have been flushed."""
+        if self.batch or not self.queue.empty():
+            self.flush_requested.set()
+        await self.queue.join()
+
+    async def wait(self, tokens: Iterable[Any]) -> None:
+        """Flush now, and wait until the given tracked tokens have been flushed.
+
+        Unlike `join()`, tokens scheduled by others are not waited for.
+        """
+        futures = {self.flushed[token] for token in tokens if token in self.flushed}
+        if futures:
+            self.flush_requested.set()
+            await asyncio.wait(futures)
+
+    def _take(self, limit: int) -> list[Any]:
+        tokens, self.batch = self.batch, []
+        while len(tokens) < limit and not self.queue.empty():
+            tokens.append(self.queue.get_nowait())
+        return tokens
+
+    async def _acknowledge(self, tokens: list[Any]) -> None:
+        try:
+            logger.debug("Acknowledging events", count=len(tokens))
+            with metrics.acknowledge_time.labels(self.user_key).time():
+                await acknowledge_events(self.graphql_client, tokens)
+            metrics.acknowledged.labels(self.user_key).inc(len(tokens))
+        except Exception:  # pragma: no cover
+            logger.exception("Unable to acknowledge events")
+        finally:
+            for token in tokens:
+                self.queue.task_done()
+                flushed = self.flushed.pop(token, None)
+                if flushed is not None and not flushed.done():
+                    flushed.set_result(None)
+
+    async def run(self) -> None:
+        """Flush tokens as they are scheduled, until cancelled."""
+        while True:
+            self.batch.append(await self.queue.get())
+            with suppress(TimeoutError):
+                await asyncio.wait_for(
+                    self.flush_requested.wait(), timeout=self.interval
+                )
+            self.flush_requested.clear()
+            tokens = self._take(self.max_size)
+            if self.queue.qsize() >= self.max_size:
+                self.flush_requested.set()
+            # Shielded, so cancelling the flusher does not lose acknowledgements
+            # which are already underway. They are awaited by `close()`.
+            self.flushing = asyncio.create_task(self._acknowledge(tokens))
+            await asyncio.shield(self.flushing)
+
+    async def close(self) -> None:
+        """Flush all remaining tokens after `run()` has been cancelled."""
+        if self.flushing is not None:
+            await asyncio.wait({self.flushing})
+        while tokens := self._take(self.max_size):
+            await self._acknowledge(tokens)
+
+
+def parse_retry_after(value: str) -> float | None:
+    """Parse a Retry-After header into a number of seconds to delay.
+
+    Retry-After can either be a HTTP-date (not ISO 8601!) or a number of
+    seconds to delay.
+    https://datatracker.ietf.org/doc/html/rfc7231#section-7.1.3
+    https://datatracker.ietf.org/doc/html/rfc7231#section-7.1.1.1
+
+    Returns:
+        The delay, or None if the header is invalid.
+    """
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:  # "-0000" means UTC, but is parsed as naive
+        date = date.replace(tzinfo=timezone.utc)
+    return max((date - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class RateLimiter:
+    """Rate-limit the deliveries of all fetchers of a listener.
+
+    Deliveries are paced by a token bucket, if a `rate` is given, and paused
+    entirely while a Retry-After from the integration is in effect. Concurrent
+    Retry-Afters are coalesced into a single pause, lasting until the latest
+    deadline requested by any of them.
+    """
+
+    def __init__(self, rate: float | None = None) -> None:
+        self.rate = rate
+        # The bucket holds up to one second's worth of tokens
+        self.capacity = max(rate or 0.0, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        # Set, unless paused by a Retry-After
+        self.allowed = asyncio.Event()
+        self.allowed.set()
+        self.deadline = 0.0
+        self.resume: asyncio.TimerHandle | None = None
+
+    def pause(self, delay: float) -> float:
+        """Pause deliveries for `delay` seconds, unless already paused longer.
+
+        Returns:
+            The number of seconds the pause was extended by.
+        """
+        now = time.monotonic()
+        extension = now + delay - max(self.deadline, now)
+        if extension <= 0:
+            return 0.0
+        self.deadline = now + delay
+        self.allowed.clear()
+        if self.resume is not None:
+            self.resume.cancel()
+        self.resume = asyncio.get_running_loop().call_later(delay, self.allowed.set)
+        return extension
+
+    async def wait(self) -> None:
+        """Wait until deliveries are not paused."""
+        await self.allowed.wait()
+
+    async def acquire(self) -> None:
+        """Wait until an event may be delivered."""
+        while True:
+            await self.allowed.wait()
+            if self.rate is None:
+                return
+            now = time.monotonic()
+            elapsed, self.updated = now - self.updated, now
+            self.tokens = min(self.tokens + elapsed * self.rate, self.capacity)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class DeliveryScheduler:
+    """Arbitrate the integration's handler capacity between listeners.
+
+    At most `capacity` events are delivered at the same time. When the capacity
+    is exhausted, waiting deliveries are granted in order of event priority,
+    lowest first, as in OS2mo. Deliveries of equal priority are granted by
+    weighted fair queueing, so each listener gets a share of the capacity
+    proportional to its `weight`, no matter how many events it has waiting.
+    """
+
+    def __init__(self, capacity: int | None = None) -> None:
+        self.capacity = capacity
+        self.running = 0
+        self.waiters: list[tuple[int, float, int, asyncio.Future[None]]] = []
+        # Virtual time of the scheduler, and of each listener's latest grant
+        self.virtual_time = 0.0
+        self.finish_times: dict[str, float] = {}
+        self.sequence = itertools.count()
+
+    def _finish_time(self, listener: Listener) -> float:
+        start = max(self.finish_times.get(listener.user_key, 0.0), self.virtual_time)
+        finish = start + 1 / listener.weight
+        self.finish_times[listener.user_key] = finish
+        return finish
+
+    def _release(self) -> None:
+        assert self.capacity is not None
+        self.running -= 1
+        while self.waiters and self.running < self.capacity:
+            _, finish, _, waiter = heapq.heappop(self.waiters)
+            if waiter.cancelled():
+                continue
+            self.virtual_time = finish
+            self.running += 1
+            waiter.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, listener: Listener, priority: int) -> AsyncIterator[None]:
+        """Wait for the listener's turn to deliver an event of `priority`."""
+        if self.capacity is None:
+            yield
+            return
+        finish = self._finish_time(listener)
+        if self.running < self.capacity and not self.waiters:
+            self.virtual_time = finish
+            self.running += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            heapq.heappush(
+                self.waiters, (priority, finish, next(self.sequence), waiter)
+            )
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # The slot was granted just as we were cancelled; pass it on
+                if waiter.done() and not waiter.cancelled():
+                    self._release()
+                raise
+        try:
+            yield
+        finally:
+            self._release()
+
+
+def _set_event() -> asyncio.Event:
+    event = asyncio.Event()
+    event.set()
+    return event
+
+
+@dataclass
+class FetcherStats:
+    """Observations of a listener's fetchers, used for autoscaling."""
+
+    fetches: int = 0
+    hits: int = 0
+    deliveries: int = 0
+    delivery_seconds: float = 0.0
+    rate_limits: int = 0
+
+
+@dataclass(frozen=True)
+class DeadLetter:
+    """An event which the integration's handler failed repeatedly."""
+
+    listener: str
+    subject: str
+    priority: int
+    failures: int
+    dead_lettered_at: datetime
+
+
+class DeadLetterStore:
+    """Local SQLite store of dead-lettered events.
+
+    Uses the standard library's synchronous SQLite module from a thread, as
+    dead-lettering is rare enough that a single connection suffices.
+
+    Args:
+        database: Path of the database, or ":memory:".
+    """
+
+    def __init__(self, database: str = ":memory:") -> None:
+        self.connection = sqlite3.connect(database, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS dead_letters ("
+                " listener TEXT NOT NULL,"
+                " subject TEXT NOT NULL,"
+                " priority INTEGER NOT NULL,"
+                " failures INTEGER NOT NULL,"
+                " dead_lettered_at TEXT NOT NULL,"
+                " PRIMARY KEY (listener, subject))"
+            )
+        # The connection must not be used by multiple threads at the same time
+        self.lock = asyncio.Lock()
+
+    async def _execute(self, sql: str, parameters: tuple = ()) -> list[tuple]:
+        def execute() -> list[tuple]:
+            with self.connection:
+                return self.connection.execute(sql, parameters).fetchall()
+
+        async with self.lock:
+            return await asyncio.to_thread(execute)
+
+    async def add(self, dead_letter: DeadLetter) -> None:
+        """Store a dead letter, replacing any earlier one for the subject."""
+        await self._execute(
+            "INSERT OR REPLACE INTO dead_letters VALUES (?, ?, ?, ?, ?)",
+            (
+                dead_letter.listener,
+                dead_letter.subject,
+                dead_letter.priority,
+                dead_letter.failures,
+                dead_letter.dead_lettered_at.isoformat(),
+            ),
+        )
+
+    async def get(self, listener: str) -> list[DeadLetter]:
+        """Get the dead letters of a listener, oldest first."""
+        rows = await self._execute(
+            "SELECT * FROM dead_letters WHERE listener = ?"
+            " ORDER BY dead_lettered_at, rowid",
+            (listener,),
+        )
+        return [
+            DeadLetter(
+                listener=listener,
+                subject=subject,
+                priority=priority,
+                failures=failures,
+                dead_lettered_at=datetime.fromisoformat(dead_lettered_at),
+            )
+            for listener, subject, priority, failures, dead_lettered_at in rows
+        ]
+
+    async def remove(self, listener: str, subject: str) -> None:
+        """Remove a dead letter, e.g. after it has been replayed."""
+        await self._execute(
+            "DELETE FROM dead_letters WHERE listener = ? AND subject = ?",
+            (listener, subject),
+        )
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+@dataclass
+class Replay:
+    """Event replayed to the integration outside of OS2mo, see `events_replay`."""
+
+    event: FetchEventEventFetch
+    request_id: str
+    # Resolved with whether the integration handled the event
+    delivered: asyncio.Future[bool]
+
+
+# Queued for delivery by a deliverer
+Delivery = FetchEventEventFetch | Replay
+
+
+@dataclass
+class ListenerState:
+    """State shared by all fetchers of a listener."""
+
+    listener: Listener
+    uuid: UUID
+    backoff: IdleBackoff
+    acknowledger: Acknowledger
+    # Paces deliveries, and pauses all fetchers on Retry-After
+    rate_limiter: RateLimiter = field(default_factory=RateLimiter)
+    # Shared by all listeners
+    scheduler: DeliveryScheduler = field(default_factory=DeliveryScheduler)
+    # Cleared to pause all fetchers while one of them probes an idle listener
+    events_available: asyncio.Event = field(default_factory=_set_event)
+    probe_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    stats: FetcherStats = field(default_factory=FetcherStats)
+    # Tokens of the events coalesced into each subject's pending delivery
+    pending: dict[str, list[Any]] = field(default_factory=dict)
+    # Delivery queues of the shard deliverers, if subjects are serialized
+    shards: list[asyncio.Queue[Delivery]] = field(default_factory=list)
+    # Consecutive delivery failures by subject, if dead-lettering is enabled
+    failures: dict[str, int] = field(default_factory=dict)
+    dead_letters: DeadLetterStore | None = None
+
+
+async def probe(
+    fetch: Callable[[], Awaitable[list[FetchEventEventFetch]]],
+    rate_limiter: RateLimiter,
+    events_available: asyncio.Event,
+    backoff: IdleBackoff,
+) -> list[FetchEventEventFetch]:
+    """Poll for events on behalf of all idle fetchers of a listener.
+
+    The other fetchers wait for `events_available` while the probe is running,
+    so an idle listener polls OS2mo once per backoff period regardless of its
+    parallelism. The probe ends when it fetches events itself, or when another
+    fetcher, which was still busy as the listener went idle, fetches some.
+
+    Returns:
+        The events fetched by the probe, if any.
+    """
+    events_available.clear()
+    try:
+        while True:
+            with suppress(TimeoutError):
+                await asyncio.wait_for(
+                    events_available.wait(), timeout=backoff.next_delay()
+                )
+            if events_available.is_set():
+                return []
+            await rate_limiter.wait()
+            if events := await fetch():
+                backoff.reset()
+                return events
+    finally:
+        # Always wake the other fetchers, even if the probe failed, so the
+        # listener cannot be stuck waiting for a probe which is not running.
+        events_available.set()
+
+
+def encode_event(event: FetchEventEventFetch) -> bytes:
+    """Serialize a fetched event as the JSON body of an `Event`.
+
+    Equivalent to `jsonable_encoder(Event(subject=..., priority=...))`, but
+    without instantiating the generic model and walking it with the encoder
+    for every delivered event.
+    """
+    subject = encode_basestring(event.subject)
+    return f'{{"subject":{subject},"priority":{int(event.priority)}}}'.encode()
+
+
+def pool_wait_trace(user_key: str) -> Callable[[str, dict], Awaitable[None]]:
+    """Get an HTTPX trace callback which measures the wait for a connection.
+
+    The first event traced by HTTPCore for a request is either connecting or
+    sending the request on a connection from the pool, so the time until then
+    is spent waiting for the pool.
+    """
+    start = time.monotonic()
+    observed = False
+
+    async def trace(event_name: str, info: dict) -> None:
+        nonlocal observed
+        if not observed and event_name.endswith(".started"):
+            observed = True
+            wait = time.monotonic() - start
+            metrics.deliver_pool_wait_time.labels(user_key).observe(wait)
+
+    return trace
+
+
+def pool_size(events: GraphQLEvents) -> int:
+    """Number of connections needed to deliver events without waiting."""
+    # Each fetcher or shard deliverer delivers one event at a time
+    size = sum(
+        max(listener.max_parallelism or 0, listener.parallelism)
+        for listener in events.declare_listeners
+    )
+    if events.max_concurrent_deliveries is not None:
+        size = min(size, events.max_concurrent_deliveries)
+    return max(size, 1)
+
+
+async def deliver(
     integration_client: AsyncClient,
-    graphql_client: GraphQLClient,
-    listener: UUID,
-    path: str,
-    rate_limit_allowed: asyncio.Event,
-    fetcher_number: int,
+    state: ListenerState,
+    event: FetchEventEventFetch,
+    request_id: str,
+    log: structlog.stdlib.BoundLogger,
+    track_failures: bool = True,
+) -> bool:
+    """HTTP POST event to the integration.
+
+    Unless `track_failures` is false, consecutive failures are counted towards
+    dead-lettering the subject.
+
+    Returns:
+        Whether the event was handled and should be acknowledged.
+    """
+    user_key = state.listener.user_key
+    start = time.monotonic()
+    try:
+        with (
+            metrics.deliver_inprogress.labels(user_key).track_inprogress(),
+            metrics.deliver_time.labels(user_key).time(),
+        ):
+            r = await integration_client.post(
+                state.listener.path,
+                headers={
+                    "x-request-id": request_id,
+                    "content-type": "application/json",
+                },
+                # Pass all event arguments; we let the receiver decide which
+                # are important.
+                content=encode_event(event),
+                extensions={"trace": pool_wait_trace(user_key)},
+            )
+    except ConnectError:  # pragma: no cover
+        log.warning("Unable to pass event to integration (ConnectError)")
+        await asyncio.sleep(5)
+        return False
+    metrics.deliver_responses.labels(user_key, str(r.status_code)).inc()
+    state.stats.deliveries += 1
+    state.stats.delivery_seconds += time.monotonic() - start
+    # 2xx is acknowledged, anything else is not. The GraphQL event
+    # system does not have negative acknowledgements.
+    try:
+        r.raise_for_status()
+    except HTTPStatusError as e:
+        log.warning(
+            "HTTP status error in event callback",
+            graphql_event=event,
+            status_code=e.response.status_code,
+            response=e.response.text,
+        )
+        # Rate-limiting
+        if retry_after := e.response.headers.get("Retry-After"):
+            delay = parse_retry_after(retry_after)
+            if delay is None:
+                log.warning("Invalid Retry-After", retry_after=retry_after)
+                return False
+            log.warning("Rate-limited", delay=delay)
+            state.stats.rate_limits += 1
+            # Pause all fetchers for this listener
+            extension = state.rate_limiter.pause(delay)
+            metrics.rate_limit_time.labels(user_key).inc(extension)
+        elif track_failures and state.listener.dead_letter_threshold is not None:
+            state.failures[event.subject] = state.failures.get(event.subject, 0) + 1
+        return False
+    if track_failures:
+        state.failures.pop(event.subject, None)
+    return True
+
+
+async def dead_letter(
+    state: ListenerState,
+    event: FetchEventEventFetch,
+    log: structlog.stdlib.BoundLogger,
+) -> bool:
+    """Park the event in the dead-letter store if it has failed too often.
+
+    Returns:
+        Whether the event was dead-lettered and should be acknowledged.
+    """
+    threshold = state.listener.dead_letter_threshold
+    if threshold is None or state.dead_letters is None:
+        return False
+    failures = state.failures.get(event.subject, 0)
+    if failures < threshold:
+        return False
+    log.error("Dead-lettering event", graphql_event=event, failures=failures)
+    await state.dead_letters.add(
+        DeadLetter(
+            listener=state.listener.user_key,
+            subject=event.subject,
+            priority=event.priority,
+            failures=failures,
+            dead_lettered_at=datetime.now(timezone.utc),
+        )
+    )
+    del state.failures[event.subject]
+    metrics.dead_lettered.labels(state.listener.user_key).inc()
+    return True
+
+
+async def deliverer(
+    integration_client: AsyncClient,
+    state: ListenerState,
+    deliveries: asyncio.Queue[Delivery],
+    log: structlog.stdlib.BoundLogger,
 ) -> None:
-    log = logger.bind(listener=listener, n=fetcher_number)
-    log.info("Starting fetcher")
+    """Deliver events from the queue to the integration, one at a time.
+
+    Handled events are passed on to the listener's acknowledger. The outcome of
+    replayed events is passed back to the replay instead.
+    """
+    listener = state.listener
     while True:
+        event = await deliveries.get()
+        replay = None
+        if isinstance(event, Replay):
+            replay, event = event, event.event
         # Must be string so we don't log like:
         #
         #   {
@@ -92,81 +876,369 @@ async def fetcher(
         #   }
         #
         # in the JSON logs.
-        request_id = str(uuid4())
+        request_id = replay.request_id if replay is not None else str(uuid4())
+        tokens = [event.token]
+        acknowledging = False
         with bound_contextvars(request_id=request_id):
             try:
-                # Wait until the event is set. This will pause the fetcher if
-                # another fetcher for the same listener received a Retry-After.
-                await rate_limit_allowed.wait()
+                # Prefetched events must also respect a Retry-After
+                # received while delivering an earlier one.
+                await state.rate_limiter.acquire()
+                async with state.scheduler.slot(listener, event.priority):
+                    # Later events for the subject must be delivered again,
+                    # as they may not be seen by this delivery.
+                    if listener.coalesce and replay is None:
+                        tokens = state.pending.pop(event.subject)
+                    delivered = await deliver(
+                        integration_client=integration_client,
+                        state=state,
+                        event=event,
+                        request_id=request_id,
+                        log=log,
+                        track_failures=replay is None,
+                    )
+                if replay is not None:
+                    replay.delivered.set_result(delivered)
+                elif delivered or await dead_letter(state, event, log):
+                    for token in tokens:
+                        state.acknowledger.put(token)
+                    acknowledging = True
+            except Exception:  # pragma: no cover
+                log.exception("Unexpected exception in GraphQL event fetcher")
+                await asyncio.sleep(5)
+            finally:
+                if replay is not None and not replay.delivered.done():
+                    replay.delivered.set_result(False)
+                if replay is None and not acknowledging:
+                    state.acknowledger.forget(tokens)
+                deliveries.task_done()
+
+
+def shard(subject: str, shards: int) -> int:
+    """Get the delivery shard of a subject.
+
+    The hash is stable, unlike Python's `hash()` of strings, so a subject always
+    maps to the same shard.
+    """
+    return zlib.crc32(subject.encode()) % shards
 
-                # Fetch GraphQL event from MO
-                try:
-                    event = await graphql_client.fetch_event(listener)
-                except ConnectError:  # pragma: no cover
-                    log.warning("Unable to fetch event (ConnectError)")
-                    await asyncio.sleep(5)
-                    continue
-                log.debug("Fetched event", graphql_event=event)
-                if event is None:
-                    await asyncio.sleep(NO_EVENT_SLEEP_DURATION)
-                    continue
 
-                # HTTP POST event to the integration
+async def deliver_replay(
+    integration_client: AsyncClient,
+    state: ListenerState,
+    event: FetchEventEventFetch,
+    request_id: str,
+    log: structlog.stdlib.BoundLogger,
+) -> bool:
+    """Deliver an event replayed outside of OS2mo, see `events_replay`.
+
+    The event is rate-limited and scheduled like the listener's own events, and
+    delivered by the subject's shard deliverer if the listener serializes
+    subjects. Failures do not count towards dead-lettering.
+
+    Returns:
+        Whether the event was handled.
+    """
+    if state.shards:
+        replay = Replay(
+            event=event,
+            request_id=request_id,
+            delivered=asyncio.get_running_loop().create_future(),
+        )
+        await state.shards[shard(event.subject, len(state.shards))].put(replay)
+        return await replay.delivered
+    await state.rate_limiter.acquire()
+    async with state.scheduler.slot(state.listener, event.priority):
+        return await deliver(
+            integration_client=integration_client,
+            state=state,
+            event=event,
+            request_id=request_id,
+            log=log,
+            track_failures=False,
+        )
+
+
+async def fetcher(
+    integration_client: AsyncClient,
+    graphql_client: GraphQLClient,
+    state: ListenerState,
+    fetcher_number: int,
+    stop: asyncio.Event,
+) -> None:
+    """Fetch, deliver, and acknowledge events for a listener.
+
+    The fetcher is a pipeline of stages connected by queues: a fetch stage, a
+    deliver stage, and the listener's shared acknowledger. Fetching from and
+    acknowledging to OS2mo overlap with the integration's handling of events,
+    unless `prefetch` is zero, in which case the next batch is only fetched
+    once the previous one has been delivered and acknowledged.
+
+    If the listener serializes subjects, events are delivered by the
+    listener's shard deliverers instead of the fetcher's own.
+
+    The fetcher returns once `stop` is set and the events it already fetched
+    have been delivered, and acknowledged if handled. It does not wait for the
+    events fetched by the listener's other fetchers, which may share its shard
+    deliverers and acknowledger.
+    """
+    listener = state.listener
+    log = logger.bind(listener=state.uuid, n=fetcher_number)
+    log.info("Starting fetcher")
+    deliveries: asyncio.Queue[Delivery] = asyncio.Queue(maxsize=listener.prefetch)
+    # Cleared while the fetch stage is fetching, or holds events which have not
+    # been queued for delivery yet, i.e. while it is unsafe to cancel.
+    idle = asyncio.Event()
+    idle.set()
+    # Tokens of the fetched events which have not been acknowledged or failed
+    fetched: set[Any] = set()
+
+    def track(token: Any) -> None:
+        fetched.add(token)
+        flushed = state.acknowledger.expect(token)
+        flushed.add_done_callback(lambda _: fetched.discard(token))
+
+    async def fetch() -> list[FetchEventEventFetch]:
+        idle.clear()
+        events = []
+        try:
+            with metrics.fetch_time.labels(listener.user_key).time():
+                events = await fetch_events(
+                    graphql_client, state.uuid, listener.batch_size
+                )
+        finally:
+            if not events:
+                idle.set()
+        for event in events:
+            track(event.token)
+        state.stats.fetches += 1
+        state.stats.hits += bool(events)
+        metrics.fetches.labels(listener.user_key).inc()
+        if not events:
+            metrics.fetches_empty.labels(listener.user_key).inc()
+        metrics.fetched.labels(listener.user_key).inc(len(events))
+        return events
+
+    def queue(event: FetchEventEventFetch) -> asyncio.Queue[Delivery]:
+        if state.shards:
+            return state.shards[shard(event.subject, len(state.shards))]
+        return deliveries
+
+    async def fetch_stage() -> None:
+        while not stop.is_set():
+            try:
+                # This will pause the fetcher if another fetcher for the same
+                # listener received a Retry-After.
+                await state.rate_limiter.wait()
+                # Similarly, wait while another fetcher is probing an idle
+                # listener.
+                await state.events_available.wait()
+
+                # Fetch GraphQL events from MO
                 try:
-                    r = await integration_client.post(
-                        path,
-                        headers={
-                            "x-request-id": request_id,
-                        },
-                        # Pass all event arguments; we let the receiver decide which
-                        # are important.
-                        json=jsonable_encoder(
-                            Event(
-                                subject=event.subject,
-                                priority=event.priority,
+                    events = await fetch()
+                    if events:
+                        state.backoff.reset()
+                        state.events_available.set()  # end any ongoing probe
+                    elif not stop.is_set() and not state.probe_lock.locked():
+                        async with state.probe_lock:
+                            events = await probe(
+                                fetch=fetch,
+                                rate_limiter=state.rate_limiter,
+                                events_available=state.events_available,
+                                backoff=state.backoff,
                             )
-                        ),
-                    )
                 except ConnectError:  # pragma: no cover
-                    log.warning("Unable to pass event to integration (ConnectError)")
+                    log.warning("Unable to fetch event (ConnectError)")
                     await asyncio.sleep(5)
                     continue
-                # 2xx is acknowledged, anything else is not. The GraphQL event
-                # system does not have negative acknowledgements.
-                try:
-                    r.raise_for_status()
-                except HTTPStatusError as e:
-                    log.warning(
-                        "HTTP status error in event callback",
-                        graphql_event=event,
-                        status_code=e.response.status_code,
-                        response=e.response.text,
-                    )
-                    # Rate-limiting
-                    if retry_after := e.response.headers.get("Retry-After"):
-                        # Retry-After can either be a HTTP-date (not ISO 8601!) or
-                        # a number of seconds to delay. We only support the latter.
-                        # https://datatracker.ietf.org/doc/html/rfc7231#section-7.1.3
-                        # https://datatracker.ietf.org/doc/html/rfc7231#section-7.1.1.1
-                        delay = int(retry_after)
-                        log.warning("Rate-limited", delay=delay)
-                        rate_limit_allowed.clear()  # pause all fetchers for this listener
-                        await asyncio.sleep(delay)
-                        rate_limit_allowed.set()  # resume all fetchers for this listener
-                    continue
-                log.debug("Acknowledging event", graphql_event=event)
-                await graphql_client.acknowledge_event(event.token)
+
+                for event in events:
+                    log.debug("Fetched event", graphql_event=event)
+                    if listener.coalesce:
+                        tokens = state.pending.get(event.subject)
+                        if tokens is not None:
+                            log.debug("Coalesced event", graphql_event=event)
+                            metrics.coalesced.labels(listener.user_key).inc()
+                            tokens.append(event.token)
+                            continue
+                        state.pending[event.subject] = [event.token]
+                    await queue(event).put(event)
+                idle.set()
+                if not listener.prefetch:
+                    await state.acknowledger.wait(event.token for event in events)
             except Exception:  # pragma: no cover
+                idle.set()
                 log.exception("Unexpected exception in GraphQL event fetcher")
                 await asyncio.sleep(5)
 
+    async with asyncio.TaskGroup() as tg:
+        fetching = tg.create_task(fetch_stage())
+        delivering = tg.create_task(
+            deliverer(integration_client, state, deliveries, log)
+        )
+
+        await stop.wait()
+        log.info("Stopping fetcher")
+        # The fetch stage stops by itself after queueing what it holds. Once it
+        # holds nothing, e.g. because a fetch came back empty, or it is waiting
+        # for anything else, such as a probe, it can safely be cancelled.
+        until_idle = asyncio.ensure_future(idle.wait())
+        await asyncio.wait({fetching, until_idle}, return_when=asyncio.FIRST_COMPLETED)
+        until_idle.cancel()
+        fetching.cancel()
+        await asyncio.wait({fetching})
+        await state.acknowledger.wait(list(fetched))
+        delivering.cancel()
+
+
+class Autoscaler:
+    """Grow and shrink the number of fetchers of a listener.
+
+    Every `AUTOSCALE_INTERVAL` seconds, the fetchers' observations since the
+    previous adjustment decide the new number of fetchers, between the
+    listener's `parallelism` and `max_parallelism`:
+
+    * Any Retry-After from the integration halves the number of fetchers.
+    * Handler latency far above the best recently observed means that the
+      integration is saturated, so more fetchers would only queue up in it.
+      One fetcher is removed.
+    * If nearly all fetches return events, there is a backlog. One fetcher is
+      added.
+    * If most fetches return nothing, the fetchers are mostly idle. One fetcher
+      is removed.
+    """
+
+    def __init__(
+        self,
+        state: ListenerState,
+        start_fetcher: Callable[[int, asyncio.Event], None],
+    ) -> None:
+        self.state = state
+        self.start_fetcher = start_fetcher
+        self.stops: list[asyncio.Event] = []
+        self.baseline_latency: float | None = None
+
+    @property
+    def scale(self) -> int:
+        """The current number of fetchers."""
+        return len(self.stops)
+
+    def scale_to(self, scale: int) -> None:
+        """Start or stop fetchers until `scale` are running."""
+        while self.scale < scale:
+            stop = asyncio.Event()
+            self.start_fetcher(self.scale, stop)
+            self.stops.append(stop)
+        while self.scale > scale:
+            self.stops.pop().set()
+        metrics.fetchers.labels(self.state.listener.user_key).set(scale)
+
+    def decide(self, stats: FetcherStats) -> int:
+        """Decide the number of fetchers from the observations in `stats`."""
+        listener = self.state.listener
+        minimum = listener.parallelism
+        maximum = max(listener.max_parallelism or minimum, minimum)
+
+        latency = None
+        if stats.deliveries:
+            latency = stats.delivery_seconds / stats.deliveries
+            # The baseline slowly follows handlers which become inherently
+            # slower, e.g. due to larger objects.
+            if self.baseline_latency is None:
+                self.baseline_latency = latency
+            self.baseline_latency = min(latency, self.baseline_latency * 1.1)
+        hit_rate = stats.hits / stats.fetches if stats.fetches else 0.0
+
+        scale = self.scale
+        if stats.rate_limits:
+            scale //= 2
+        elif (
+            latency is not None
+            and self.baseline_latency is not None
+            and latency > 2 * self.baseline_latency
+        ):
+            scale -= 1
+        elif hit_rate >= 0.9:
+            scale += 1
+        elif hit_rate < 0.5:
+            scale -= 1
+        return max(minimum, min(scale, maximum))
+
+    async def run(self) -> None:
+        """Periodically adjust the number of fetchers."""
+        log = logger.bind(listener=self.state.uuid)
+        while True:
+            await asyncio.sleep(AUTOSCALE_INTERVAL)
+            stats, self.state.stats = self.state.stats, FetcherStats()
+            scale = self.decide(stats)
+            if scale != self.scale:
+                log.info("Autoscaling fetchers", old=self.scale, new=scale)
+            self.scale_to(scale)
+
+
+@dataclass
+class RunningEvents:
+    """The running GraphQL event system, for use by its API endpoints."""
+
+    graphql_client: GraphQLClient
+    integration_client: AsyncClient
+    # Creates a client to the integration with a connection pool of the given
+    # size, so replays do not compete with the listeners' deliveries for the
+    # connections of `integration_client`
+    connect: Callable[[int], AsyncClient]
+    task_group: asyncio.TaskGroup
+    # Listener states by listener user_key
+    states: dict[str, ListenerState] = field(default_factory=dict)
+    # Replays by listener user_key, see `events_replay`
+    replays: dict[str, Any] = field(default_factory=dict)
+
+
+def connect_integration(
+    events: GraphQLEvents, app: FastAPI, connections: int
+) -> AsyncClient:
+    """HTTPX client to call the integration itself.
+
+    Args:
+        connections: Size of the client's connection pool.
+    """
+    if events.in_process_dispatch:
+        # Requests are passed directly to the ASGI application, skipping the
+        # network stack entirely. Application exceptions are returned as 500
+        # responses, exactly as if the request had been served over HTTP.
+        return AsyncClient(
+            transport=ASGITransport(app=app, raise_app_exceptions=False),
+            base_url="http://fastramqpi",
+        )
+    return AsyncClient(
+        # We assume the integration is listening on port 8000
+        base_url="http://127.0.0.1:8000",
+        # Raise the timeout from the default of 5 seconds
+        timeout=300,
+        transport=AsyncHTTPTransport(
+            limits=Limits(
+                max_connections=connections, max_keepalive_connections=connections
+            ),
+            http1=not events.http2,
+            http2=events.http2,
+            uds=events.integration_uds,
+        ),
+    )
+
 
 @asynccontextmanager
 async def lifespan(
     settings: Settings,
     mo_client: AsyncClient,
     events: GraphQLEvents,
+    app: FastAPI,
 ) -> AsyncIterator[None]:
+    # The dead-letter store is only opened if any listener uses it
+    dead_letters = None
+    if any(listener.dead_letter_threshold for listener in events.declare_listeners):
+        if events.dead_letter_database is None:
+            raise ValueError("dead_letter_threshold requires a dead_letter_database")
+        dead_letters = DeadLetterStore(events.dead_letter_database)
     # The regular GraphQL client available in the FastRAMQPI context is
     # specific to each integration. We don't know which version of GraphQL it
     # it using, and we cannot define the required queries in it.
@@ -176,51 +1248,148 @@ async def lifespan(
         url=f"{settings.mo_url}/graphql/v25",
         http_client=mo_client,
     )
-    # HTTPX client to call the integration itself
-    integration_client = AsyncClient(
-        # We assume the integration is listening on port 8000
-        base_url="http://127.0.0.1:8000",
-        # Raise the timeout from the default of 5 seconds
-        timeout=300,
-    )
+    # Enough connections for all fetchers to deliver at the same time, so that
+    # deliveries do not silently queue up inside HTTPX.
+    integration_client = connect_integration(events, app, pool_size(events))
     logger.info("Starting GraphQL event fetchers")
-    try:
-        async with graphql_client, asyncio.TaskGroup() as tg:
-            # Declare namespaces
-            for namespace in events.declare_namespaces:
-                logger.info("Declaring namespace", namespace=namespace)
-                await graphql_client.declare_event_namespace(
-                    input=NamespaceCreateInput(
-                        name=namespace.name,
-                        public=namespace.public,
-                    )
-                )
-            # Declare listeners
-            for listener in events.declare_listeners:
-                logger.info("Declaring listener", listener=listener)
-                graphql_listener = await graphql_client.declare_event_listener(
-                    input=ListenerCreateInput(
-                        namespace=listener.namespace,
-                        user_key=listener.user_key,
-                        routing_key=listener.routing_key,
-                    )
-                )
-                # All fetchers for a listener share the same rate-limiting
-                rate_limit_allowed = asyncio.Event()
-                rate_limit_allowed.set()
-                for i in range(listener.parallelism):
-                    tg.create_task(
+    scheduler = DeliveryScheduler(capacity=events.max_concurrent_deliveries)
+    states: list[ListenerState] = []
+    autoscalers: list[Autoscaler] = []
+    autoscaling: list[asyncio.Task] = []
+    fetchers: set[asyncio.Task] = set()
+    async with graphql_client, integration_client:
+        try:
+            async with asyncio.TaskGroup() as tg:
+
+                def start_fetcher(
+                    state: ListenerState, fetcher_number: int, stop: asyncio.Event
+                ) -> None:
+                    task = tg.create_task(
                         fetcher(
                             integration_client=integration_client,
                             graphql_client=graphql_client,
-                            listener=graphql_listener.uuid,
-                            path=listener.path,
-                            rate_limit_allowed=rate_limit_allowed,
-                            fetcher_number=i,
+                            state=state,
+                            fetcher_number=fetcher_number,
+                            stop=stop,
                         )
                     )
-            yield
-            logger.info("Stopping GraphQL event fetchers")
-            tg.create_task(terminate_task_group())
-    except* TerminateTaskGroup:
-        pass
+                    fetchers.add(task)
+                    task.add_done_callback(fetchers.discard)
+
+                async def declare_namespace(namespace: Namespace) -> None:
+                    logger.info("Declaring namespace", namespace=namespace)
+                    await graphql_client.declare_event_namespace(
+                        input=NamespaceCreateInput(
+                            name=namespace.name,
+                            public=namespace.public,
+                        )
+                    )
+
+                async def declare_listener(listener: Listener) -> None:
+                    # Wait for the namespace, if we are declaring it ourselves
+                    if (namespace := namespaces.get(listener.namespace)) is not None:
+                        await namespace
+                    logger.info("Declaring listener", listener=listener)
+                    graphql_listener = await graphql_client.declare_event_listener(
+                        input=ListenerCreateInput(
+                            namespace=listener.namespace,
+                            user_key=listener.user_key,
+                            routing_key=listener.routing_key,
+                        )
+                    )
+                    max_idle_sleep = listener.max_idle_sleep
+                    if max_idle_sleep is None:
+                        max_idle_sleep = NO_EVENT_SLEEP_DURATION
+                    # All fetchers for a listener share the same rate-limiting,
+                    # idle probing, and acknowledgement.
+                    state = ListenerState(
+                        listener=listener,
+                        uuid=graphql_listener.uuid,
+                        backoff=IdleBackoff(
+                            minimum=listener.min_idle_sleep,
+                            maximum=max_idle_sleep,
+                        ),
+                        acknowledger=Acknowledger(
+                            graphql_client=graphql_client,
+                            max_size=listener.acknowledge_batch_size,
+                            interval=listener.acknowledge_interval,
+                            user_key=listener.user_key,
+                        ),
+                        rate_limiter=RateLimiter(rate=listener.max_events_per_second),
+                        scheduler=scheduler,
+                        dead_letters=dead_letters,
+                    )
+                    states.append(state)
+                    running.states[listener.user_key] = state
+                    tg.create_task(state.acknowledger.run())
+                    if listener.serialize_subjects:
+                        shards = max(
+                            listener.max_parallelism or 0, listener.parallelism
+                        )
+                        for n in range(shards):
+                            deliveries: asyncio.Queue[Delivery] = asyncio.Queue(
+                                maxsize=listener.prefetch
+                            )
+                            state.shards.append(deliveries)
+                            tg.create_task(
+                                deliverer(
+                                    integration_client=integration_client,
+                                    state=state,
+                                    deliveries=deliveries,
+                                    log=logger.bind(listener=state.uuid, shard=n),
+                                )
+                            )
+                    autoscaler = Autoscaler(
+                        state=state, start_fetcher=partial(start_fetcher, state)
+                    )
+                    autoscalers.append(autoscaler)
+                    autoscaler.scale_to(listener.parallelism)
+                    if listener.max_parallelism is not None:
+                        autoscaling.append(tg.create_task(autoscaler.run()))
+
+                running = RunningEvents(
+                    graphql_client=graphql_client,
+                    integration_client=integration_client,
+                    connect=partial(connect_integration, events, app),
+                    task_group=tg,
+                )
+                app.state.graphql_events = running
+
+                # Declare all namespaces and listeners concurrently. Each
+                # listener's fetchers start as soon as it has been declared.
+                namespaces = {
+                    namespace.name: tg.create_task(declare_namespace(namespace))
+                    for namespace in events.declare_namespaces
+                }
+                listeners = [
+                    tg.create_task(declare_listener(listener))
+                    for listener in events.declare_listeners
+                ]
+                await asyncio.gather(*namespaces.values(), *listeners)
+                yield
+                logger.info("Stopping GraphQL event fetchers")
+                # Drain: stop fetching, and let the fetchers finish delivering
+                # and acknowledging the events they hold, so they are not
+                # redelivered by OS2mo after the next start.
+                for task in autoscaling:
+                    task.cancel()
+                for autoscaler in autoscalers:
+                    autoscaler.scale_to(0)
+                if fetchers:
+                    _, remaining = await asyncio.wait(
+                        fetchers, timeout=events.drain_timeout
+                    )
+                    if remaining:
+                        logger.warning(
+                            "Timed out draining GraphQL event fetchers",
+                            remaining=len(remaining),
+                        )
+                tg.create_task(terminate_task_group())
+        except* TerminateTaskGroup:
+            pass
+        # Events handled before the fetchers were stopped must still be
+        # acknowledged, or OS2mo will deliver them again.
+        for state in states:
+            await state.acknowledger.close()
+        if dead_letters is not None:
+            dead_letters.close()
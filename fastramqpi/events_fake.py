@@ -0,0 +1,272 @@
+# SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+"""In-memory stand-in for OS2mo's GraphQL event API.
+
+Allows testing and benchmarking the `events` pipeline without a running OS2mo:
+
+    fake = FakeMO(latency=0.005, backlog=10_000)
+    async with events.lifespan(settings, fake.client(), graphql_events, app):
+        ...
+
+Only the parts of the GraphQL schema used by the event system are implemented;
+`event_fetch`, `event_acknowledge`, `event_listener_declare`,
+`event_namespace_declare`, and `event_send`, and the paginated `uuid`s of the
+given `collections` for replays.
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import time
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Any
+from uuid import uuid4
+
+import httpx
+from graphql import GraphQLResolveInfo
+from graphql import build_schema
+from graphql import default_field_resolver
+from graphql import graphql
+
+SDL = """
+scalar UUID
+scalar EventToken
+scalar Cursor
+scalar int
+
+type Event {
+  subject: String!
+  priority: Int!
+  token: EventToken!
+}
+
+type Listener {
+  uuid: UUID!
+}
+
+type Namespace {
+  name: String!
+}
+
+type Object {
+  uuid: UUID!
+}
+
+type PageInfo {
+  next_cursor: Cursor
+}
+
+type Page {
+  objects: [Object!]!
+  page_info: PageInfo!
+}
+
+input EventFilter {
+  listener: UUID!
+}
+
+input EventAcknowledgeInput {
+  token: EventToken!
+}
+
+input EventSendInput {
+  namespace: String!
+  routing_key: String!
+  subject: String!
+  priority: Int! = 10000
+}
+
+input ListenerCreateInput {
+  namespace: String! = "mo"
+  user_key: String!
+  routing_key: String!
+}
+
+input NamespaceCreateInput {
+  name: String!
+  public: Boolean! = false
+}
+
+type Query {
+  event_fetch(filter: EventFilter!): Event
+}
+
+type Mutation {
+  event_acknowledge(input: EventAcknowledgeInput!): Boolean!
+  event_listener_declare(input: ListenerCreateInput!): Listener!
+  event_namespace_declare(input: NamespaceCreateInput!): Namespace!
+  event_send(input: EventSendInput!): Boolean!
+}
+"""
+
+schema = build_schema(SDL)
+
+
+@dataclass
+class FakeEvent:
+    subject: str
+    priority: int
+    token: str = ""
+    fetched_at: float = 0.0
+
+
+@dataclass
+class FakeListener:
+    uuid: str
+    namespace: str
+    routing_key: str
+    # Events waiting to be fetched, ordered by priority and age
+    pending: list[tuple[int, int, FakeEvent]] = field(default_factory=list)
+    # Fetched events by token, and the expiry of their leases
+    leased: dict[str, FakeEvent] = field(default_factory=dict)
+    leases: list[tuple[float, str]] = field(default_factory=list)
+
+
+class FakeMO:
+    """Fake OS2mo event API, served through an HTTPX transport.
+
+    Args:
+        latency: Seconds to delay each GraphQL request.
+        retry_delay: Seconds before an unacknowledged event can be fetched again.
+        backlog: Number of events, with random subjects, waiting for every
+            listener when it is declared.
+        collections: Subjects of the collections to enumerate, e.g. "employees".
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        retry_delay: float = 30.0,
+        backlog: int = 0,
+        collections: dict[str, list[str]] | None = None,
+    ) -> None:
+        self.latency = latency
+        self.retry_delay = retry_delay
+        self.backlog = backlog
+        self.collections = collections or {}
+        self.schema = schema
+        if self.collections:
+            self.schema = build_schema(
+                SDL
+                + "".join(
+                    f"extend type Query {{ {name}(limit: int, cursor: Cursor): Page! }}\n"
+                    for name in self.collections
+                )
+            )
+        self.namespaces: set[str] = {"mo"}
+        # Listeners by (namespace, user_key), and by UUID
+        self.listeners: dict[tuple[str, str], FakeListener] = {}
+        self.listeners_by_uuid: dict[str, FakeListener] = {}
+        self.sequence = itertools.count()
+        # Statistics
+        self.requests = 0
+        self.fetched = 0
+        self.acknowledged = 0
+        # Seconds from the latest fetch to the acknowledgement of each event
+        self.latencies: list[float] = []
+
+    def send(
+        self, namespace: str, routing_key: str, subject: str, priority: int = 10000
+    ) -> None:
+        """Send an event to all listeners bound to the routing key."""
+        for listener in self.listeners.values():
+            if (listener.namespace, listener.routing_key) == (namespace, routing_key):
+                event = FakeEvent(subject=subject, priority=priority)
+                heapq.heappush(listener.pending, (priority, next(self.sequence), event))
+
+    def unacknowledged(self) -> int:
+        """Number of events which have not been acknowledged yet."""
+        return sum(
+            len(listener.pending) + len(listener.leased)
+            for listener in self.listeners.values()
+        )
+
+    # Resolvers, called by GraphQL's default resolver on the root value
+
+    def event_namespace_declare(self, info: Any, input: dict) -> dict:
+        self.namespaces.add(input["name"])
+        return {"name": input["name"]}
+
+    def event_listener_declare(self, info: Any, input: dict) -> dict:
+        namespace = input["namespace"]
+        if namespace not in self.namespaces:
+            raise ValueError(f"Namespace does not exist: {namespace}")
+        key = (namespace, input["user_key"])
+        if key not in self.listeners:
+            listener = FakeListener(
+                uuid=str(uuid4()), namespace=namespace, routing_key=input["routing_key"]
+            )
+            self.listeners[key] = listener
+            self.listeners_by_uuid[listener.uuid] = listener
+            for _ in range(self.backlog):
+                self.send(namespace, listener.routing_key, str(uuid4()))
+        return {"uuid": self.listeners[key].uuid}
+
+    def event_send(self, info: Any, input: dict) -> bool:
+        self.send(**input)
+        return True
+
+    def event_fetch(self, info: Any, filter: dict) -> FakeEvent | None:
+        listener = self.listeners_by_uuid[str(filter["listener"])]
+        now = time.monotonic()
+        # Return expired leases to the pending events
+        while listener.leases and listener.leases[0][0] <= now:
+            _, token = heapq.heappop(listener.leases)
+            if (event := listener.leased.pop(token, None)) is not None:
+                item = (event.priority, next(self.sequence), event)
+                heapq.heappush(listener.pending, item)
+        if not listener.pending:
+            return None
+        _, _, event = heapq.heappop(listener.pending)
+        event.token = str(uuid4())
+        event.fetched_at = now
+        listener.leased[event.token] = event
+        heapq.heappush(listener.leases, (now + self.retry_delay, event.token))
+        self.fetched += 1
+        return event
+
+    def event_acknowledge(self, info: Any, input: dict) -> bool:
+        for listener in self.listeners.values():
+            if (event := listener.leased.pop(input["token"], None)) is not None:
+                self.acknowledged += 1
+                self.latencies.append(time.monotonic() - event.fetched_at)
+                break
+        return True
+
+    def page(self, collection: str, limit: int, cursor: str | None) -> dict:
+        start = int(cursor or 0)
+        end = start + limit
+        subjects = self.collections[collection]
+        return {
+            "objects": [{"uuid": subject} for subject in subjects[start:end]],
+            "page_info": {"next_cursor": str(end) if end < len(subjects) else None},
+        }
+
+    def resolve(self, source: Any, info: GraphQLResolveInfo, **args: Any) -> Any:
+        if source is self and info.field_name in self.collections:
+            return self.page(info.field_name, **args)
+        return default_field_resolver(source, info, **args)
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        """Execute a GraphQL request."""
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        payload = json.loads(request.content)
+        result = await graphql(
+            self.schema,
+            payload["query"],
+            root_value=self,
+            field_resolver=self.resolve,
+            variable_values=payload.get("variables"),
+            operation_name=payload.get("operationName"),
+        )
+        return httpx.Response(200, json=result.formatted)
+
+    def client(self) -> httpx.AsyncClient:
+        """HTTPX client for use as the MO client of the event system."""
+        return httpx.AsyncClient(
+            transport=httpx.MockTransport(self.handle), base_url="http://mo"
+        )
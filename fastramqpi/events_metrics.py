@@ -0,0 +1,95 @@
+# SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+"""This module contains the prometheus metrics of the GraphQL event system.
+
+All metrics are labelled by the `user_key` of the listener.
+"""
+
+from prometheus_client import Counter
+from prometheus_client import Gauge
+from prometheus_client import Histogram
+
+# ------------- #
+# Fetch metrics #
+# ------------- #
+
+fetchers = Gauge(
+    "graphql_events_fetchers",
+    "Number of GraphQL event fetchers running for the listener",
+    ["listener"],
+)
+fetch_time = Histogram(
+    "graphql_events_fetch_seconds",
+    "Time spent fetching events from OS2mo",
+    ["listener"],
+)
+fetches = Counter(
+    "graphql_events_fetches",
+    "Number of GraphQL requests made to fetch events",
+    ["listener"],
+)
+fetches_empty = Counter(
+    "graphql_events_fetches_empty",
+    "Number of GraphQL requests made to fetch events which returned none",
+    ["listener"],
+)
+fetched = Counter(
+    "graphql_events_fetched",
+    "Number of events fetched from OS2mo",
+    ["listener"],
+)
+coalesced = Counter(
+    "graphql_events_coalesced",
+    "Number of fetched events coalesced into a pending delivery for the subject",
+    ["listener"],
+)
+
+# ---------------- #
+# Delivery metrics #
+# ---------------- #
+
+deliver_time = Histogram(
+    "graphql_events_deliver_seconds",
+    "Time spent delivering events to the integration's handler",
+    ["listener"],
+)
+deliver_pool_wait_time = Histogram(
+    "graphql_events_deliver_pool_wait_seconds",
+    "Time spent waiting for a connection to the integration",
+    ["listener"],
+)
+deliver_inprogress = Gauge(
+    "graphql_events_deliver_inprogress",
+    "Number of events currently being delivered to the integration's handler",
+    ["listener"],
+)
+deliver_responses = Counter(
+    "graphql_events_deliver_responses",
+    "Number of responses from the integration's handler",
+    ["listener", "status_code"],
+)
+rate_limit_time = Counter(
+    "graphql_events_rate_limit_seconds",
+    "Time spent paused by Retry-After from the integration's handler",
+    ["listener"],
+)
+dead_lettered = Counter(
+    "graphql_events_dead_lettered",
+    "Number of events parked in the dead-letter store after repeated failures",
+    ["listener"],
+)
+
+# ----------------------- #
+# Acknowledgement metrics #
+# ----------------------- #
+
+acknowledged = Counter(
+    "graphql_events_acknowledged",
+    "Number of events acknowledged to OS2mo",
+    ["listener"],
+)
+acknowledge_time = Histogram(
+    "graphql_events_acknowledge_seconds",
+    "Time spent acknowledging events to OS2mo",
+    ["listener"],
+)
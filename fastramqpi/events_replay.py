@@ -0,0 +1,285 @@
+# SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+"""Replay of GraphQL events for every object in a collection.
+
+Used to reprocess objects, e.g. after fixing a bug in an integration, without
+crafting refresh mutations by hand. The subjects are enumerated from OS2mo
+through cursor pagination and delivered directly to the listener's handler,
+through the same rate-limiting, scheduling, and subject serialization as the
+listener's events. Failed replays do not count towards dead-lettering. Unless
+subjects are serialized, replays connect to the integration with connections
+of their own, so a backfill does not hold up the delivery of new events.
+
+A replay runs in the background and is controlled through the API:
+
+* `POST /graphql-events/listeners/{user_key}/replay` starts a replay.
+* `GET /graphql-events/listeners/{user_key}/replay` shows its progress.
+* `DELETE /graphql-events/listeners/{user_key}/replay` cancels it.
+
+A cancelled or failed replay can be resumed by starting a new one from the
+`cursor` of its progress.
+
+Events parked in the dead-letter store, see `Listener.dead_letter_threshold`,
+are replayed in the same way once the integration has been fixed:
+
+* `GET /graphql-events/listeners/{user_key}/dead-letters` lists them.
+* `POST /graphql-events/listeners/{user_key}/dead-letters/replay` delivers them
+  again, optionally only for the given `subject`, and removes the ones handled.
+"""
+
+import asyncio
+
+import structlog
+from fastapi import APIRouter
+from fastapi import HTTPException
+from fastapi import Request
+from httpx import AsyncClient
+from pydantic import BaseModel
+from pydantic import Field
+from starlette.status import HTTP_202_ACCEPTED
+from starlette.status import HTTP_404_NOT_FOUND
+from starlette.status import HTTP_409_CONFLICT
+
+from .autogenerated_graphql_client import FetchEventEventFetch
+from .autogenerated_graphql_client import GraphQLClient
+from .events import DeadLetter
+from .events import DeadLetterStore
+from .events import ListenerState
+from .events import RateLimiter
+from .events import RunningEvents
+from .events import deliver_replay
+
+logger = structlog.stdlib.get_logger()
+
+
+class ReplayRequest(BaseModel):
+    """Replay of the objects of a collection."""
+
+    # GraphQL collection to enumerate subjects from, e.g. "employees". It is
+    # part of the query, so it is restricted to what collection names look like.
+    collection: str = Field(regex=r"^[a-z_]+$")
+    # Number of subjects enumerated per GraphQL request
+    page_size: int = Field(100, ge=1)
+    # Number of events delivered to the integration at the same time
+    parallelism: int = Field(1, ge=1)
+    # Maximum number of events delivered per second
+    rate: float | None = Field(None, gt=0)
+    priority: int = 10000
+    # Resume from the cursor of an earlier replay
+    cursor: str | None = None
+
+
+class ReplayProgress(BaseModel):
+    """Progress of a replay."""
+
+    request: ReplayRequest
+    # Cursor of the next page to replay. Events of the current page may be
+    # delivered again when resuming from it.
+    cursor: str | None = None
+    pages: int = 0
+    delivered: int = 0
+    # Subjects for which the integration did not handle the event
+    failed: list[str] = []
+    done: bool = False
+    error: str | None = None
+
+
+class DeadLetterReplay(BaseModel):
+    """Result of replaying dead letters."""
+
+    delivered: list[str] = []
+    # Subjects which are still dead-lettered
+    failed: list[str] = []
+
+
+async def fetch_subjects(
+    graphql_client: GraphQLClient, collection: str, limit: int, cursor: str | None
+) -> tuple[list[str], str | None]:
+    """Fetch a page of subjects from a collection.
+
+    Returns:
+        The subjects, and the cursor of the next page, if any.
+    """
+    query = (
+        "query ReplaySubjects($limit: int, $cursor: Cursor) {"
+        f" {collection}(limit: $limit, cursor: $cursor) {{"
+        " objects { uuid } page_info { next_cursor } } }"
+    )
+    response = await graphql_client.execute(
+        query=query, variables={"limit": limit, "cursor": cursor}
+    )
+    page = graphql_client.get_data(response)[collection]
+    subjects = [str(obj["uuid"]) for obj in page["objects"]]
+    return subjects, page["page_info"]["next_cursor"]
+
+
+async def replay(
+    graphql_client: GraphQLClient,
+    integration_client: AsyncClient,
+    state: ListenerState,
+    progress: ReplayProgress,
+) -> None:
+    """Replay events for every object of a collection, one page at a time.
+
+    The progress is updated as pages are completed.
+    """
+    request = progress.request
+    log = logger.bind(listener=state.uuid, collection=request.collection)
+    log.info("Starting replay", cursor=progress.cursor)
+    rate_limiter = RateLimiter(rate=request.rate)
+
+    async def worker(subjects: list[str]) -> None:
+        while subjects:
+            subject = subjects.pop()
+            event = FetchEventEventFetch(
+                subject=subject, priority=request.priority, token=None
+            )
+            await rate_limiter.acquire()
+            delivered = await deliver_replay(
+                integration_client=integration_client,
+                state=state,
+                event=event,
+                request_id=f"replay-{subject}",
+                log=log,
+            )
+            if delivered:
+                progress.delivered += 1
+            else:
+                progress.failed.append(subject)
+
+    while True:
+        subjects, cursor = await fetch_subjects(
+            graphql_client, request.collection, request.page_size, progress.cursor
+        )
+        subjects.reverse()  # workers pop from the end
+        async with asyncio.TaskGroup() as tg:
+            for _ in range(request.parallelism):
+                tg.create_task(worker(subjects))
+        progress.pages += 1
+        log.info(
+            "Replayed page",
+            pages=progress.pages,
+            delivered=progress.delivered,
+            failed=len(progress.failed),
+        )
+        if cursor is None:
+            break
+        progress.cursor = cursor
+    progress.done = True
+    log.info("Finished replay", delivered=progress.delivered)
+
+
+router = APIRouter(prefix="/graphql-events")
+
+
+def _running(request: Request, user_key: str) -> RunningEvents:
+    running: RunningEvents | None = getattr(request.app.state, "graphql_events", None)
+    if running is None or user_key not in running.states:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="Unknown listener")
+    return running
+
+
+def _replay(request: Request, user_key: str) -> tuple[asyncio.Task, ReplayProgress]:
+    running = _running(request, user_key)
+    if user_key not in running.replays:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="No replay")
+    replay: tuple[asyncio.Task, ReplayProgress] = running.replays[user_key]
+    return replay
+
+
+@router.post("/listeners/{user_key}/replay", status_code=HTTP_202_ACCEPTED)
+async def start_replay(
+    request: Request, user_key: str, replay_request: ReplayRequest
+) -> ReplayProgress:
+    """Start replaying events for every object of a collection."""
+    running = _running(request, user_key)
+    if user_key in running.replays and not running.replays[user_key][0].done():
+        raise HTTPException(status_code=HTTP_409_CONFLICT, detail="Already replaying")
+    progress = ReplayProgress(request=replay_request, cursor=replay_request.cursor)
+
+    async def run() -> None:
+        # Exceptions must not take down the event system's task group
+        try:
+            async with running.connect(replay_request.parallelism) as client:
+                await replay(
+                    graphql_client=running.graphql_client,
+                    integration_client=client,
+                    state=running.states[user_key],
+                    progress=progress,
+                )
+        except Exception as e:
+            logger.exception("Replay failed", listener=user_key)
+            progress.error = str(e)
+
+    running.replays[user_key] = (running.task_group.create_task(run()), progress)
+    return progress
+
+
+@router.get("/listeners/{user_key}/replay")
+async def get_replay(request: Request, user_key: str) -> ReplayProgress:
+    """Get the progress of the listener's latest replay."""
+    _, progress = _replay(request, user_key)
+    return progress
+
+
+@router.delete("/listeners/{user_key}/replay")
+async def cancel_replay(request: Request, user_key: str) -> ReplayProgress:
+    """Cancel the listener's replay. It can be resumed from its cursor."""
+    task, progress = _replay(request, user_key)
+    task.cancel()
+    return progress
+
+
+def _dead_letters(
+    request: Request, user_key: str
+) -> tuple[ListenerState, DeadLetterStore]:
+    state = _running(request, user_key).states[user_key]
+    if state.dead_letters is None:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="No dead letters")
+    return state, state.dead_letters
+
+
+@router.get("/listeners/{user_key}/dead-letters")
+async def get_dead_letters(request: Request, user_key: str) -> list[DeadLetter]:
+    """List the listener's dead-lettered events."""
+    _, dead_letters = _dead_letters(request, user_key)
+    return await dead_letters.get(user_key)
+
+
+@router.post("/listeners/{user_key}/dead-letters/replay")
+async def replay_dead_letters(
+    request: Request, user_key: str, subject: str | None = None
+) -> DeadLetterReplay:
+    """Deliver the listener's dead-lettered events again, one at a time.
+
+    Handled events are removed from the dead-letter store.
+    """
+    running = _running(request, user_key)
+    state, dead_letters = _dead_letters(request, user_key)
+    log = logger.bind(listener=state.uuid)
+    result = DeadLetterReplay()
+    async with running.connect(1) as client:
+        for dead_letter in await dead_letters.get(user_key):
+            if subject is not None and dead_letter.subject != subject:
+                continue
+            event = FetchEventEventFetch(
+                subject=dead_letter.subject, priority=dead_letter.priority, token=None
+            )
+            delivered = await deliver_replay(
+                integration_client=client,
+                state=state,
+                event=event,
+                request_id=f"dead-letter-{dead_letter.subject}",
+                log=log,
+            )
+            if delivered:
+                await dead_letters.remove(user_key, dead_letter.subject)
+                result.delivered.append(dead_letter.subject)
+            else:
+                result.failed.append(dead_letter.subject)
+    log.info(
+        "Replayed dead letters",
+        delivered=len(result.delivered),
+        failed=len(result.failed),
+    )
+    return result
@@ -19,6 +19,7 @@ from fastramqpi.events import GraphQLEvents
 
 from . import database
 from . import events
+from . import events_replay
 from .app import FastAPIIntegrationSystem
 from .config import ClientSettings
 from .config import Settings
@@ -185,9 +186,11 @@ class FastRAMQPI(FastAPIIntegrationSystem):
                     settings=settings,
                     mo_client=mo_client,
                     events=graphql_events,
+                    app=self.app,
                 ),
                 priority=1000,
             )
+            self.app.include_router(events_replay.router)
 
         # Prepare legacy clients
         legacy_graphql_client, legacy_model_client = construct_legacy_clients(
@@ -5,6 +5,7 @@
 
 import asyncio
 import json
+import time
 from abc import ABCMeta
 from asyncio import CancelledError
 from collections.abc import Callable
@@ -42,6 +43,7 @@ from .metrics import _setup_connection_metrics
 from .metrics import _setup_periodic_metrics
 from .metrics import callbacks_registered
 from .metrics import routes_bound
+from .metrics import startup_time
 from .utils import AcknowledgeMessage
 from .utils import CallbackType
 from .utils import RejectMessage
@@ -59,10 +61,15 @@ class AbstractRouter:
 
     def __init__(self, dependencies: list[Any] | None = None) -> None:
         self.registry: dict[CallbackType, set[str]] = {}
+        # Prefetch of callbacks which consume on their own channel
+        self.prefetch: dict[CallbackType, int] = {}
         self.dependencies = dependencies or []
 
     def _register(
-        self, routing_key: Any, dependencies: list[Any] | None = None
+        self,
+        routing_key: Any,
+        dependencies: list[Any] | None = None,
+        prefetch: int | None = None,
     ) -> Callable[[CallbackType], CallbackType]:
         """Get a decorator for registering callbacks.
 
@@ -94,10 +101,19 @@ class AbstractRouter:
             def callback1(message: IncomingMessage):
                 pass
             ```
+            Or on its own channel, so a slow callback cannot starve others:
+            ```
+            @router.register("person", prefetch=2)
+            def callback1(message: IncomingMessage):
+                pass
+            ```
 
         Args:
             routing_key: The routing key to bind messages for.
             dependencies: Additional dependencies to inject.
+            prefetch: Consume messages for the callback on a channel of its own,
+                handling at most this many in parallel. By default, callbacks
+                share a channel, and its `prefetch_count`.
 
         Returns:
             A decorator for registering a function to receive callbacks.
@@ -105,6 +121,8 @@ class AbstractRouter:
         # Allow using any custom object as routing key as long as it implements __str__
         routing_key = str(routing_key)
         assert routing_key != ""
+        # A prefetch_count of zero means unlimited to RabbitMQ
+        assert prefetch is None or prefetch >= 1
 
         def decorator(function: CallbackType) -> CallbackType:
             """Registers the given callback and routing key in the callback registry.
@@ -122,6 +140,8 @@ class AbstractRouter:
 
             callbacks_registered.labels(routing_key).inc()
             self.registry.setdefault(function, set()).add(routing_key)
+            if prefetch is not None:
+                self.prefetch[function] = prefetch
 
             current_dependencies = getattr(function, "dependencies", self.dependencies)
             current_dependencies.extend(dependencies or [])
@@ -230,10 +250,14 @@ class AbstractAMQPSystem(AbstractAsyncContextManager, Generic[TRouter]):
 
         self._connection: AbstractRobustConnection | None = None
         self._channel: AbstractRobustChannel | None = None
+        # Channels of callbacks registered with their own prefetch, by function name
+        self._channels: dict[str, AbstractRobustChannel] = {}
         self._exchange: AbstractExchange | None = None
         self._queues: dict[str, AbstractQueue] = {}
         self._consumer_tags: dict[AbstractQueue, str] = {}
         self._closing = False
+        # Dependency-injected handlers by callback, see _handler
+        self._handlers: dict[CallbackType, Callable] = {}
 
         self._periodic_task: asyncio.Task | None = None
 
@@ -269,11 +293,34 @@ class AbstractAMQPSystem(AbstractAsyncContextManager, Generic[TRouter]):
         return (
             self._connection is not None
             and self._connection.is_closed is False
-            and self._channel is not None
-            and self._channel.is_closed is False
-            and self._channel.is_initialized
+            and all(
+                channel is not None
+                and channel.is_closed is False
+                and channel.is_initialized
+                for channel in [self._channel, *self._channels.values()]
+            )
         )
 
+    def _handler(self, callback: CallbackType) -> Callable:
+        """Get the dependency-injected handler of a callback.
+
+        Analysing the dependencies of a callback is expensive, so the handler is
+        built once per callback and reused for every message.
+
+        Args:
+            callback: The callback to get the handler for.
+
+        Returns:
+            The handler, taking the message and context as keyword arguments.
+        """
+        handler = self._handlers.get(callback)
+        if handler is None:
+            handler = dependency_injected_with_deps(
+                callback, getattr(callback, "dependencies", []) + self.dependencies
+            )
+            self._handlers[callback] = handler
+        return handler
+
     async def start(self) -> None:  # pragma: no cover
         """Start the AMQPSystem.
 
@@ -285,6 +332,7 @@ class AbstractAMQPSystem(AbstractAsyncContextManager, Generic[TRouter]):
         * Setups up periodic metrics.
         """
         logger.info("Starting AMQP system")
+        start = time.monotonic()
         settings = self.settings
 
         # We expect no active connections to be established
@@ -299,6 +347,11 @@ class AbstractAMQPSystem(AbstractAsyncContextManager, Generic[TRouter]):
         if self.router.registry:
             assert settings.queue_prefix is not None
 
+        # Analyse the dependencies of all callbacks up front, instead of on the
+        # first message for each
+        for callback in self.router.registry:
+            self._handler(callback)
+
         url = settings.get_url()
         logger.info(
             "Establishing AMQP connection",
@@ -328,91 +381,130 @@ class AbstractAMQPSystem(AbstractAsyncContextManager, Generic[TRouter]):
             )
             await self._exchange.bind(upstream_exchange, routing_key="*")
 
-        # TODO: Create queues and binds in parallel?
+        # Set up the queues of all callbacks concurrently, as each takes several
+        # round-trips to the broker. Operations on the shared channel are still
+        # serialized by the broker protocol, but callbacks with their own channel,
+        # and the quorum migration probes, which use temporary channels, overlap.
         self._queues = {}
-        for callback, routing_keys in self.router.registry.items():
-            function_name = function_to_name(callback)
-            queue_name = f"{settings.queue_prefix}_{function_name}"
-            log = logger.bind(queue=queue_name)
-
-            log.info("Declaring unique message queue")
-            # Make our queue quorum, so it survives broker restarts, and so that
-            # messages that are rejected or nacked will be returned to the _back_ of
-            # the queue. This allows us to consume as many messages as possible,
-            # instead of blocking on the first unprocessable one.
-            # NOTE: If a delivery-limit is set, the queue will use the original
-            # behaviour of returning the message near the head of the queue.
-            # https://www.rabbitmq.com/quorum-queues.html#repeated-requeues
-
-            # TODO: BEGIN quorum migration
-            async def ensure_quorum() -> bool:
-                """Attempt to allow migration to a quorum queue.
-
-                Returns: True, if the queue is already, or can be, migrated to
-                         (declared as) a quorum queue. False otherwise.
-                """
-                # pylint: disable=cell-var-from-loop
-                assert self._connection is not None
+        semaphore = asyncio.Semaphore(settings.declare_concurrency)
+
+        async def setup_queue(callback: CallbackType, routing_keys: set[str]) -> None:
+            async with semaphore:
+                await self._setup_queue(callback, routing_keys)
+
+        # Raise the first error as is, like setting up the queues one at a time
+        # would, instead of the task group's ExceptionGroup
+        try:
+            async with asyncio.TaskGroup() as tg:
+                for callback, routing_keys in self.router.registry.items():
+                    tg.create_task(setup_queue(callback, routing_keys))
+        except ExceptionGroup as group:
+            raise group.exceptions[0]
+
+        self._periodic_task = _setup_periodic_metrics(self._queues)
+        duration = time.monotonic() - start
+        startup_time.set(duration)
+        logger.info("Started AMQP system", duration=duration)
+
+    async def _setup_queue(
+        self, callback: CallbackType, routing_keys: set[str]
+    ) -> None:  # pragma: no cover
+        """Declare the queue of a callback, bind its routing keys, and consume it.
+
+        Args:
+            callback: The callback to set up the queue for.
+            routing_keys: The routing keys to bind to the queue.
+        """
+        settings = self.settings
+        assert self._connection is not None
+        assert self._channel is not None
+        assert self._exchange is not None
+        function_name = function_to_name(callback)
+        queue_name = f"{settings.queue_prefix}_{function_name}"
+        log = logger.bind(queue=queue_name)
+
+        channel = self._channel
+        prefetch = self.router.prefetch.get(callback)
+        if prefetch is not None:
+            log.info("Creating AMQP channel", prefetch=prefetch)
+            channel = cast(AbstractRobustChannel, await self._connection.channel())
+            await channel.set_qos(prefetch_count=prefetch)
+            _setup_channel_metrics(channel)
+            self._channels[function_name] = channel
+
+        log.info("Declaring unique message queue")
+        # Make our queue quorum, so it survives broker restarts, and so that
+        # messages that are rejected or nacked will be returned to the _back_ of
+        # the queue. This allows us to consume as many messages as possible,
+        # instead of blocking on the first unprocessable one.
+        # NOTE: If a delivery-limit is set, the queue will use the original
+        # behaviour of returning the message near the head of the queue.
+        # https://www.rabbitmq.com/quorum-queues.html#repeated-requeues
+
+        # TODO: BEGIN quorum migration
+        async def ensure_quorum() -> bool:
+            """Attempt to allow migration to a quorum queue.
+
+            Returns: True, if the queue is already, or can be, migrated to
+                     (declared as) a quorum queue. False otherwise.
+            """
+            assert self._connection is not None
+            try:
+                # Try to declare the queue as quorum. The call uses a temporary
+                # channel since it will be closed on ChannelPreconditionFailed.
+                async with self._connection.channel() as temporary_channel:
+                    await temporary_channel.declare_queue(
+                        queue_name,
+                        durable=True,
+                        arguments={
+                            "x-queue-type": "quorum",
+                        },
+                    )
+                # If that worked, the queue is already migrated
+                return True
+            except ChannelPreconditionFailed as error:
+                # If we cannot declare the queue as quorum, it's probably because
+                # it already exists as a non-quorum classical queue.
+                assert "inequivalent arg 'x-queue-type'" in one(error.args)
+                # If so -- and it's empty -- try to delete it
                 try:
-                    # Try to declare the queue as quorum. The call uses a temporary
-                    # channel since it will be closed on ChannelPreconditionFailed.
+                    log.warning("Quorum migration: Deleting existing classic queue")
                     async with self._connection.channel() as temporary_channel:
-                        await temporary_channel.declare_queue(
-                            queue_name,
-                            durable=True,
-                            arguments={
-                                "x-queue-type": "quorum",
-                            },
-                        )
-                    # If that worked, the queue is already migrated
-                    return True
-                except ChannelPreconditionFailed as error:
-                    # If we cannot declare the queue as quorum, it's probably because
-                    # it already exists as a non-quorum classical queue.
-                    assert "inequivalent arg 'x-queue-type'" in one(error.args)
-                    # If so -- and it's empty -- try to delete it
-                    try:
-                        log.warning("Quorum migration: Deleting existing classic queue")
-                        async with self._connection.channel() as temporary_channel:
-                            q = await temporary_channel.get_queue(
-                                queue_name, ensure=True
-                            )
-                            await q.delete(if_empty=True)
-                            # If that worked, the queue can be declared as quorum
-                            return True
-                    except ChannelPreconditionFailed:
-                        # If we are unable to delete the existing queue, there's nothing
-                        # we can do. Let the caller know they should use a classic queue
-                        # for now.
-                        log.warning("Unable to delete queue (probably non-empty)")
-                        return False
-
-            if not await ensure_quorum():
-                queue = await self._channel.declare_queue(queue_name, durable=True)
-            else:
-                # TODO: END quorum migration
-                # This is the code that would remain after the migration period
-                queue = await self._channel.declare_queue(
-                    queue_name,
-                    durable=True,
-                    arguments={
-                        "x-queue-type": "quorum",
-                    },
-                )
-
-            self._queues[function_name] = queue
-
-            log.info("Binding routing keys")
-            for routing_key in routing_keys:
-                log.info("Binding routing-key", routing_key=routing_key)
-                await queue.bind(self._exchange, routing_key=routing_key)
-                routes_bound.labels(function_name).inc()
-
-            log.info("Starting message listener")
-            consumer_tag = await queue.consume(partial(self._on_message, callback))
-            self._consumer_tags[queue] = consumer_tag
+                        q = await temporary_channel.get_queue(queue_name, ensure=True)
+                        await q.delete(if_empty=True)
+                        # If that worked, the queue can be declared as quorum
+                        return True
+                except ChannelPreconditionFailed:
+                    # If we are unable to delete the existing queue, there's nothing
+                    # we can do. Let the caller know they should use a classic queue
+                    # for now.
+                    log.warning("Unable to delete queue (probably non-empty)")
+                    return False
+
+        if settings.quorum_migration and not await ensure_quorum():
+            queue = await channel.declare_queue(queue_name, durable=True)
+        else:
+            # TODO: END quorum migration
+            # This is the code that would remain after the migration period
+            queue = await channel.declare_queue(
+                queue_name,
+                durable=True,
+                arguments={
+                    "x-queue-type": "quorum",
+                },
+            )
 
-        self._periodic_task = _setup_periodic_metrics(self._queues)
+        self._queues[function_name] = queue
+
+        log.info("Binding routing keys")
+        for routing_key in routing_keys:
+            log.info("Binding routing-key", routing_key=routing_key)
+            await queue.bind(self._exchange, routing_key=routing_key)
+            routes_bound.labels(function_name).inc()
+
+        log.info("Starting message listener")
+        consumer_tag = await queue.consume(partial(self._on_message, callback))
+        self._consumer_tags[queue] = consumer_tag
 
     async def stop(self) -> None:  # pragma: no cover
         """Stop the AMQPSystem.
@@ -438,6 +530,7 @@ class AbstractAMQPSystem(AbstractAsyncContextManager, Generic[TRouter]):
 
         if self._channel is not None:
             self._channel = None
+        self._channels = {}
 
         if self._connection is not None:
             logger.info("Closing AMQP connection")
@@ -515,10 +608,7 @@ class AbstractAMQPSystem(AbstractAsyncContextManager, Generic[TRouter]):
                 async with message.process(requeue=True, ignore_processed=True):
                     try:
                         # TODO: Add retry metric
-                        await dependency_injected_with_deps(
-                            callback,
-                            getattr(callback, "dependencies", []) + self.dependencies,
-                        )(
+                        await self._handler(callback)(
                             message=message,
                             context=self.context,
                         )
@@ -83,3 +83,13 @@ class AMQPConnectionSettings(BaseModel):
 
     # Maximum number of messages to fetch and handle in parallel.
     prefetch_count: int = 10
+
+    # Maximum number of queues to declare, bind, and consume from in parallel
+    # while starting.
+    declare_concurrency: int = Field(10, ge=1)
+
+    # Probe for, and migrate, classic queues left over from before queues were
+    # made quorum, on every start. The probe opens a temporary channel per queue.
+    # Disable it once all of the integration's queues are quorum, so each queue
+    # is declared with a single round-trip.
+    quorum_migration: bool = True
@@ -9,9 +9,12 @@ from collections.abc import AsyncGenerator
 from collections.abc import Awaitable
 from collections.abc import Callable
 from collections.abc import Hashable
+from collections.abc import Mapping
 from contextlib import AsyncExitStack
 from contextlib import asynccontextmanager
+from contextlib import contextmanager
 from contextlib import suppress
+from dataclasses import dataclass
 from functools import cache
 from functools import partial
 from functools import wraps
@@ -25,14 +28,166 @@ import anyio
 from aio_pika import IncomingMessage
 from fastapi import Depends
 from fastapi import Request
+from fastapi.concurrency import contextmanager_in_threadpool
+from fastapi.concurrency import run_in_threadpool
+from fastapi.dependencies.models import Dependant
 from fastapi.dependencies.utils import get_dependant
 from fastapi.dependencies.utils import get_parameterless_sub_dependant
+from fastapi.dependencies.utils import is_async_gen_callable
+from fastapi.dependencies.utils import is_coroutine_callable
+from fastapi.dependencies.utils import is_gen_callable
 from fastapi.dependencies.utils import solve_dependencies
 from pydantic import parse_raw_as
 from starlette.datastructures import State as StarletteState
 
 T = TypeVar("T")
 
+# Synchronous dependencies from these modules are cheap accessors, such as
+# `get_context` and `from_context`, and are called directly instead of in a thread
+INLINE_MODULES = {__name__, "fastramqpi.depends"}
+
+
+class UnsupportedDependency(Exception):
+    """The dependency requires FastAPI's HTTP machinery to be resolved."""
+
+
+@dataclass(frozen=True)
+class Step:
+    """Resolution of a single dependency in an execution plan."""
+
+    call: Callable
+    # One of "state", "inline", "thread", "coroutine", "generator", or
+    # "async_generator"
+    kind: str
+    # Keyword arguments, by the index of the step which resolves them
+    arguments: tuple[tuple[str, int], ...]
+
+
+@dataclass(frozen=True)
+class Plan:
+    """Flat execution plan of a callback's dependency graph.
+
+    Every dependency is resolved by exactly one step, after the steps it depends
+    on, so it can be executed in order without recursion or cache lookups.
+    """
+
+    steps: tuple[Step, ...]
+    # Keyword arguments of the callback, by the index of the step resolving them
+    arguments: tuple[tuple[str, int], ...]
+
+
+def compile_plan(dependant: Dependant, overrides: Mapping[Callable, Callable]) -> Plan:
+    """Compile a dependency graph into a flat execution plan.
+
+    Mirrors the semantics of FastAPI's `solve_dependencies`, including caching
+    and `dependency_overrides`, for graphs consisting only of dependencies.
+
+    Args:
+        dependant: The analysed callback.
+        overrides: Dependency overrides, e.g. `app.dependency_overrides`.
+
+    Raises:
+        UnsupportedDependency: If any dependency takes HTTP parameters, such as
+            query parameters, a body, or the Request.
+
+    Returns:
+        The execution plan.
+    """
+    steps: list[Step] = []
+    cache: dict[Any, int] = {}
+
+    def visit(dependant: Dependant) -> tuple[tuple[str, int], ...]:
+        if (
+            dependant.path_params
+            or dependant.query_params
+            or dependant.header_params
+            or dependant.cookie_params
+            or dependant.body_params
+            or dependant.request_param_name
+            or dependant.websocket_param_name
+            or dependant.http_connection_param_name
+            or dependant.response_param_name
+            or dependant.background_tasks_param_name
+            or dependant.security_scopes_param_name
+        ):
+            raise UnsupportedDependency(dependant.call)
+        arguments = []
+        for sub_dependant in dependant.dependencies:
+            assert sub_dependant.call is not None
+            if sub_dependant.use_cache and sub_dependant.cache_key in cache:
+                index = cache[sub_dependant.cache_key]
+            else:
+                call = overrides.get(sub_dependant.call, sub_dependant.call)
+                if call is get_state:
+                    # The only use of the Request by AMQP callbacks
+                    step = Step(call=call, kind="state", arguments=())
+                else:
+                    use_sub_dependant = sub_dependant
+                    if call is not sub_dependant.call:
+                        use_sub_dependant = get_dependant(
+                            path=sub_dependant.path or "",
+                            call=call,
+                            name=sub_dependant.name,
+                            security_scopes=sub_dependant.security_scopes,
+                        )
+                    sub_arguments = visit(use_sub_dependant)
+                    if is_gen_callable(call):
+                        kind = "generator"
+                    elif is_async_gen_callable(call):
+                        kind = "async_generator"
+                    elif is_coroutine_callable(call):
+                        kind = "coroutine"
+                    elif getattr(call, "__module__", None) in INLINE_MODULES:
+                        kind = "inline"
+                    else:
+                        kind = "thread"
+                    step = Step(call=call, kind=kind, arguments=sub_arguments)
+                index = len(steps)
+                steps.append(step)
+                cache.setdefault(sub_dependant.cache_key, index)
+            if sub_dependant.name is not None:
+                arguments.append((sub_dependant.name, index))
+        return tuple(arguments)
+
+    arguments = visit(dependant)
+    return Plan(steps=tuple(steps), arguments=arguments)
+
+
+async def execute_plan(
+    plan: Plan, state: StarletteState, stack: AsyncExitStack
+) -> dict[str, Any]:
+    """Resolve the dependencies of a callback by executing its plan.
+
+    Args:
+        plan: The execution plan.
+        state: The state of the message, see `get_state`.
+        stack: Exit stack for the teardown of generator dependencies.
+
+    Returns:
+        The keyword arguments for the callback.
+    """
+    values: list[Any] = []
+    for step in plan.steps:
+        kwargs = {name: values[index] for name, index in step.arguments}
+        if step.kind == "state":
+            value: Any = state
+        elif step.kind == "inline":
+            value = step.call(**kwargs)
+        elif step.kind == "coroutine":
+            value = await step.call(**kwargs)
+        elif step.kind == "async_generator":
+            value = await stack.enter_async_context(
+                asynccontextmanager(step.call)(**kwargs)
+            )
+        elif step.kind == "generator":
+            value = await stack.enter_async_context(
+                contextmanager_in_threadpool(contextmanager(step.call)(**kwargs))
+            )
+        else:
+            value = await run_in_threadpool(step.call, **kwargs)
+        values.append(value)
+    return {name: values[index] for name, index in plan.arguments}
+
 
 def dependency_injected_with_deps(
     function: Callable, dependencies: list[Any]
@@ -55,6 +210,12 @@ def dependency_injected_with_deps(
         injection system, and thus detailed usage examples can be found on the FastAPI
         documentation.
 
+    Note:
+        The dependency graph is compiled once into a flat execution plan, which is
+        resolved without FastAPI's HTTP machinery, see `compile_plan`. Callbacks
+        with dependencies on the Request or HTTP parameters are resolved through
+        FastAPI's `solve_dependencies` instead.
+
     Note:
         Most users will want to use `@dependency_injected` rather than this function
         directly, as most users do not need to pass in extra dependencies explicitly.
@@ -79,6 +240,25 @@ def dependency_injected_with_deps(
             0,
             get_parameterless_sub_dependant(depends=depends, path=""),
         )
+    try:
+        plan: Plan | None = compile_plan(dependant, overrides={})
+    except UnsupportedDependency:
+        plan = None
+    # Plan compiled for the latest dependency overrides, by their items
+    overridden: tuple[tuple, Plan | None] = ((), plan)
+
+    def get_plan(context: Context) -> Plan | None:
+        nonlocal overridden
+        overrides = getattr(context.get("app"), "dependency_overrides", None)
+        if not overrides or plan is None:
+            return plan
+        key = tuple(overrides.items())
+        if key != overridden[0]:
+            try:
+                overridden = (key, compile_plan(dependant, overrides))
+            except UnsupportedDependency:
+                overridden = (key, None)
+        return overridden[1]
 
     @wraps(function)
     async def wrapper(message: IncomingMessage, context: Context) -> Any:
@@ -97,6 +277,14 @@ def dependency_injected_with_deps(
         Returns:
             What the wrapped function returns.
         """
+        if (current_plan := get_plan(context)) is not None:
+            async with AsyncExitStack() as stack:
+                state = StarletteState(
+                    {"context": context, "message": message, "callback": function}
+                )
+                values = await execute_plan(current_plan, state, stack)
+                return await function(**values)
+
         # https://github.com/fastapi/fastapi/blob/master/fastapi/routing.py
         async with AsyncExitStack() as stack:
             request = Request(
@@ -41,6 +41,10 @@ routes_bound = Counter(
 callbacks_registered = Counter(
     "amqp_callbacks_registered", "Number of callbacks registered", ["routing_key"]
 )
+startup_time = Gauge(
+    "amqp_startup_seconds",
+    "Time spent starting the AMQP system, until all queues were consumed",
+)
 event_counter = Counter("amqp_event", "Number of events made", ["event_key"])
 event_last = Gauge("amqp_event_last", "Timestamp of last event", ["event_key"])
 
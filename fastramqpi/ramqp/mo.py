@@ -269,7 +269,10 @@ class MORouter(AbstractRouter):
     """
 
     def register(
-        self, routing_key: MORoutingKey, dependencies: list[Any] | None = None
+        self,
+        routing_key: MORoutingKey,
+        dependencies: list[Any] | None = None,
+        prefetch: int | None = None,
     ) -> Callable[[CallbackType], CallbackType]:  # pragma: no cover
         """Get a decorator for registering callbacks.
 
@@ -277,11 +280,14 @@ class MORouter(AbstractRouter):
 
         Args:
             routing_key: The routing key to bind messages for.
+            dependencies: Additional dependencies to inject.
+            prefetch: Consume messages for the callback on a channel of its own,
+                handling at most this many in parallel.
 
         Returns:
             A decorator for registering a function to receive callbacks.
         """
-        return self._register(routing_key, dependencies)
+        return self._register(routing_key, dependencies, prefetch)
 
 
 class MOPublishMixin(AbstractPublishMixin):
@@ -0,0 +1,1056 @@
+# SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+import asyncio
+import json
+import time
+from collections.abc import AsyncIterator
+from collections.abc import Awaitable
+from collections.abc import Callable
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from email.utils import format_datetime
+from itertools import count
+from typing import Any
+from uuid import UUID
+from uuid import uuid4
+
+import httpx
+import pytest
+import structlog
+from fastapi import FastAPI
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from prometheus_client import REGISTRY
+
+from fastramqpi.autogenerated_graphql_client import FetchEventEventFetch
+from fastramqpi.autogenerated_graphql_client import GraphQLClient
+from fastramqpi.config import Settings
+from fastramqpi.events import Acknowledger
+from fastramqpi.events import Autoscaler
+from fastramqpi.events import DeadLetter
+from fastramqpi.events import DeadLetterStore
+from fastramqpi.events import Delivery
+from fastramqpi.events import DeliveryScheduler
+from fastramqpi.events import Event
+from fastramqpi.events import FetcherStats
+from fastramqpi.events import GraphQLEvents
+from fastramqpi.events import IdleBackoff
+from fastramqpi.events import Listener
+from fastramqpi.events import ListenerState
+from fastramqpi.events import Namespace
+from fastramqpi.events import RateLimiter
+from fastramqpi.events import acknowledge_events
+from fastramqpi.events import deliver
+from fastramqpi.events import deliver_replay
+from fastramqpi.events import deliverer
+from fastramqpi.events import encode_event
+from fastramqpi.events import fetch_events
+from fastramqpi.events import fetcher
+from fastramqpi.events import lifespan
+from fastramqpi.events import parse_retry_after
+from fastramqpi.events import pool_size
+from fastramqpi.events import pool_wait_trace
+from fastramqpi.events import probe
+from fastramqpi.events import shard
+from fastramqpi.events_fake import FakeMO
+
+GraphQLHandler = Callable[[dict[str, Any]], dict[str, Any]]
+
+
+@pytest.fixture
+def graphql_requests() -> list[dict[str, Any]]:
+    return []
+
+
+@pytest.fixture
+def pending() -> list[dict[str, Any]]:
+    """Events waiting to be fetched from the default `graphql_handler`."""
+    return []
+
+
+@pytest.fixture
+def acknowledged() -> list[Any]:
+    """Tokens acknowledged through the default `graphql_handler`."""
+    return []
+
+
+@pytest.fixture
+def graphql_handler(
+    pending: list[dict[str, Any]], acknowledged: list[Any]
+) -> GraphQLHandler:
+    """OS2mo handing out the `pending` events, and recording acknowledgements.
+
+    Tests of specific GraphQL responses parametrize this fixture instead.
+    """
+
+    def handler(payload: dict[str, Any]) -> dict[str, Any]:
+        query = payload["query"]
+        variables = payload["variables"]
+        if "event_acknowledge" in query:
+            acknowledged.extend(variables.values())
+            if "mutation AcknowledgeEvents(" in query:
+                return {f"a{i}": True for i in range(len(variables))}
+            return {"event_acknowledge": True}
+        if "query FetchEvents(" in query:
+            return {
+                f"e{i}": pending.pop(0) if pending else None
+                for i in range(query.count("event_fetch("))
+            }
+        return {"event_fetch": pending.pop(0) if pending else None}
+
+    return handler
+
+
+@pytest.fixture
+async def graphql_client(
+    graphql_requests: list[dict[str, Any]], graphql_handler: GraphQLHandler
+) -> AsyncIterator[GraphQLClient]:
+    """GraphQL client whose requests are answered by `graphql_handler`."""
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        payload = json.loads(request.content)
+        graphql_requests.append(payload)
+        return httpx.Response(200, json={"data": graphql_handler(payload)})
+
+    http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    async with GraphQLClient(
+        url="http://mo/graphql/v25", http_client=http_client
+    ) as client:
+        yield client
+
+
+LISTENER = uuid4()
+
+
+def event(subject: str) -> dict[str, Any]:
+    return {"subject": subject, "priority": 10000, "token": f"token-{subject}"}
+
+
+@pytest.mark.parametrize(
+    "graphql_handler",
+    [lambda payload: {"event_fetch": event("a")}],
+)
+async def test_fetch_events_single(
+    graphql_client: GraphQLClient, graphql_requests: list[dict[str, Any]]
+) -> None:
+    events = await fetch_events(graphql_client, LISTENER, limit=1)
+    assert events == [FetchEventEventFetch.parse_obj(event("a"))]
+    assert len(graphql_requests) == 1
+    assert "query FetchEvent(" in graphql_requests[0]["query"]
+
+
+@pytest.mark.parametrize(
+    "graphql_handler",
+    [lambda payload: {"event_fetch": None}],
+)
+async def test_fetch_events_single_empty(graphql_client: GraphQLClient) -> None:
+    assert await fetch_events(graphql_client, LISTENER, limit=1) == []
+
+
+@pytest.mark.parametrize(
+    "graphql_handler",
+    [lambda payload: {"e0": event("a"), "e1": None, "e2": event("b"), "e3": None}],
+)
+async def test_fetch_events_batch(
+    graphql_client: GraphQLClient, graphql_requests: list[dict[str, Any]]
+) -> None:
+    events = await fetch_events(graphql_client, LISTENER, limit=4)
+    assert events == [
+        FetchEventEventFetch.parse_obj(event("a")),
+        FetchEventEventFetch.parse_obj(event("b")),
+    ]
+    # All events are fetched in a single request
+    assert len(graphql_requests) == 1
+    query = graphql_requests[0]["query"]
+    assert query.count("event_fetch(") == 4
+    assert UUID(graphql_requests[0]["variables"]["listener"]) == LISTENER
+
+
+@pytest.mark.parametrize(
+    "graphql_handler",
+    [lambda payload: {"e0": event("a"), "e1": event("a")}],
+)
+async def test_fetch_events_batch_deduplicates(graphql_client: GraphQLClient) -> None:
+    events = await fetch_events(graphql_client, LISTENER, limit=2)
+    assert events == [FetchEventEventFetch.parse_obj(event("a"))]
+
+
+@pytest.mark.parametrize(
+    "graphql_handler",
+    [lambda payload: {"event_acknowledge": True}],
+)
+async def test_acknowledge_events_single(
+    graphql_client: GraphQLClient, graphql_requests: list[dict[str, Any]]
+) -> None:
+    await acknowledge_events(graphql_client, ["x"])
+    assert len(graphql_requests) == 1
+    assert graphql_requests[0]["variables"] == {"token": "x"}
+
+
+@pytest.mark.parametrize(
+    "graphql_handler",
+    [lambda payload: {f"a{i}": True for i in range(len(payload["variables"]))}],
+)
+async def test_acknowledge_events_batch(
+    graphql_client: GraphQLClient, graphql_requests: list[dict[str, Any]]
+) -> None:
+    await acknowledge_events(graphql_client, ["x", "y", "z"])
+    assert len(graphql_requests) == 1
+    assert graphql_requests[0]["query"].count("event_acknowledge(") == 3
+    assert graphql_requests[0]["variables"] == {"t0": "x", "t1": "y", "t2": "z"}
+
+
+def test_idle_backoff() -> None:
+    backoff = IdleBackoff(minimum=0.1, maximum=1.0)
+    delays = [backoff.next_delay() for _ in range(6)]
+    # Exponential, jittered, and capped
+    for delay, cap in zip(delays, [0.1, 0.2, 0.4, 0.8, 1.0, 1.0]):
+        assert cap / 2 <= delay <= cap
+    # Tight polling is resumed immediately
+    backoff.reset()
+    assert backoff.next_delay() <= 0.1
+
+
+async def test_probe() -> None:
+    rate_limiter = RateLimiter()
+    events_available = asyncio.Event()
+    events_available.set()
+    results = [[], [], [FetchEventEventFetch.parse_obj(event("a"))]]
+    fetches = 0
+
+    async def fetch() -> list[FetchEventEventFetch]:
+        nonlocal fetches
+        # Other fetchers must be parked while probing
+        assert not events_available.is_set()
+        fetches += 1
+        return results.pop(0)
+
+    backoff = IdleBackoff(minimum=0.001, maximum=0.001)
+    events = await probe(fetch, rate_limiter, events_available, backoff)
+    assert events == [FetchEventEventFetch.parse_obj(event("a"))]
+    assert fetches == 3
+    assert events_available.is_set()
+    assert backoff.delay == 0
+
+
+async def test_probe_woken_by_other_fetcher() -> None:
+    rate_limiter = RateLimiter()
+    events_available = asyncio.Event()
+
+    async def fetch() -> list[FetchEventEventFetch]:
+        return []
+
+    backoff = IdleBackoff(minimum=60, maximum=60)
+    task = asyncio.create_task(probe(fetch, rate_limiter, events_available, backoff))
+    await asyncio.sleep(0)
+    # Another fetcher fetched an event; the probe must stop without sleeping
+    events_available.set()
+    assert await asyncio.wait_for(task, timeout=1) == []
+
+
+async def test_probe_failure_wakes_other_fetchers() -> None:
+    rate_limiter = RateLimiter()
+    events_available = asyncio.Event()
+
+    async def fetch() -> list[FetchEventEventFetch]:
+        raise ValueError("boom")
+
+    backoff = IdleBackoff(minimum=0.001, maximum=0.001)
+    with pytest.raises(ValueError):
+        await probe(fetch, rate_limiter, events_available, backoff)
+    assert events_available.is_set()
+
+
+@pytest.mark.parametrize("subject", ["a", 'quote"s\\', "æøå ✉️", "\n\x00"])
+def test_encode_event(subject: str) -> None:
+    event = FetchEventEventFetch(subject=subject, priority=1337, token="token")
+    expected = jsonable_encoder(Event(subject=subject, priority=1337))
+    assert json.loads(encode_event(event)) == expected
+
+
+def listener_state(
+    graphql_client: GraphQLClient | None = None, **kwargs: Any
+) -> ListenerState:
+    if graphql_client is None:
+        graphql_client = GraphQLClient(url="http://mo/graphql/v25")
+    return ListenerState(
+        listener=Listener(
+            namespace="mo",
+            user_key="test",
+            routing_key="person",
+            path="/handler",
+            **kwargs,
+        ),
+        uuid=LISTENER,
+        backoff=IdleBackoff(minimum=0.01, maximum=0.01),
+        acknowledger=Acknowledger(
+            graphql_client=graphql_client, max_size=100, interval=0.01
+        ),
+    )
+
+
+FetcherRunner = Callable[[FastAPI, ListenerState, asyncio.Event], Awaitable[None]]
+
+
+@pytest.fixture
+def run_fetcher(graphql_client: GraphQLClient) -> FetcherRunner:
+    """Run a fetcher against `graphql_handler` and an integration until stopped.
+
+    The listener's acknowledger, and its shard deliverers, if any, run
+    alongside the fetcher.
+    """
+
+    async def run(app: FastAPI, state: ListenerState, stop: asyncio.Event) -> None:
+        async with (
+            httpx.AsyncClient(
+                transport=httpx.ASGITransport(app=app), base_url="http://fastramqpi"
+            ) as integration_client,
+            asyncio.TaskGroup() as tg,
+        ):
+            tasks = [tg.create_task(state.acknowledger.run())]
+            for deliveries in state.shards:
+                tasks.append(
+                    tg.create_task(
+                        deliverer(
+                            integration_client=integration_client,
+                            state=state,
+                            deliveries=deliveries,
+                            log=structlog.stdlib.get_logger(),
+                        )
+                    )
+                )
+            await asyncio.wait_for(
+                fetcher(
+                    integration_client=integration_client,
+                    graphql_client=graphql_client,
+                    state=state,
+                    fetcher_number=0,
+                    stop=stop,
+                ),
+                timeout=5,
+            )
+            for task in tasks:
+                task.cancel()
+
+    return run
+
+
+async def test_deliver_in_process() -> None:
+    app = FastAPI()
+    received = []
+
+    @app.post("/handler")
+    async def handler(event: Event[str]) -> None:
+        received.append(event)
+        if event.subject == "rate-limited":
+            raise HTTPException(status_code=429, headers={"Retry-After": "0"})
+        if event.subject == "failing":
+            raise ValueError("boom")
+
+    integration_client = httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app, raise_app_exceptions=False),
+        base_url="http://fastramqpi",
+    )
+    state = listener_state()
+
+    def responses(status_code: str) -> float:
+        labels = {"listener": "test", "status_code": status_code}
+        value = REGISTRY.get_sample_value(
+            "graphql_events_deliver_responses_total", labels
+        )
+        return value or 0.0
+
+    before = {code: responses(code) for code in ("200", "429", "500")}
+
+    async def deliver_subject(subject: str) -> bool:
+        return await deliver(
+            integration_client=integration_client,
+            state=state,
+            event=FetchEventEventFetch.parse_obj(event(subject)),
+            request_id="request-id",
+            log=structlog.stdlib.get_logger(),
+        )
+
+    async with integration_client:
+        assert await deliver_subject("ok") is True
+        assert await deliver_subject("rate-limited") is False
+        assert await deliver_subject("failing") is False
+    assert received == [
+        Event(subject="ok", priority=10000),
+        Event(subject="rate-limited", priority=10000),
+        Event(subject="failing", priority=10000),
+    ]
+    assert state.rate_limiter.allowed.is_set()
+    assert state.stats.deliveries == 3
+    assert state.stats.rate_limits == 1
+    assert {code: responses(code) - before[code] for code in before} == {
+        "200": 1.0,
+        "429": 1.0,
+        "500": 1.0,
+    }
+
+
+async def test_dead_letter_store(tmp_path: Any) -> None:
+    database = str(tmp_path / "dead-letters.db")
+    now = datetime.now(timezone.utc)
+
+    def dead_letter(subject: str, failures: int) -> DeadLetter:
+        return DeadLetter(
+            listener="test",
+            subject=subject,
+            priority=10000,
+            failures=failures,
+            dead_lettered_at=now + timedelta(seconds=failures),
+        )
+
+    store = DeadLetterStore(database)
+    await store.add(dead_letter("a", 3))
+    await store.add(dead_letter("b", 1))
+    await store.add(dead_letter("a", 5))
+    store.close()
+
+    # Dead letters survive restarts
+    store = DeadLetterStore(database)
+    assert await store.get("test") == [dead_letter("b", 1), dead_letter("a", 5)]
+    assert await store.get("other") == []
+    await store.remove("test", "a")
+    assert await store.get("test") == [dead_letter("b", 1)]
+    store.close()
+
+
+async def test_deliverer_dead_letters() -> None:
+    app = FastAPI()
+
+    @app.post("/handler")
+    async def handler(event: Event[str]) -> None:
+        if event.subject == "rate-limited":
+            raise HTTPException(status_code=429, headers={"Retry-After": "0"})
+        if event.subject == "poison":
+            raise ValueError("boom")
+
+    state = listener_state(dead_letter_threshold=2)
+    state.dead_letters = DeadLetterStore()
+    deliveries: asyncio.Queue[Delivery] = asyncio.Queue()
+    for token, subject in enumerate(["poison", "rate-limited"] * 3):
+        await deliveries.put(
+            FetchEventEventFetch(subject=subject, priority=10000, token=token)
+        )
+    before = REGISTRY.get_sample_value(
+        "graphql_events_dead_lettered_total", {"listener": "test"}
+    )
+
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app, raise_app_exceptions=False),
+        base_url="http://fastramqpi",
+    ) as integration_client:
+        task = asyncio.create_task(
+            deliverer(
+                integration_client=integration_client,
+                state=state,
+                deliveries=deliveries,
+                log=structlog.stdlib.get_logger(),
+            )
+        )
+        await asyncio.wait_for(deliveries.join(), timeout=5)
+        task.cancel()
+
+    # The poison event is dead-lettered and acknowledged on its second failure.
+    # Rate-limiting does not count as failing.
+    assert state.acknowledger.queue.get_nowait() == 2
+    assert state.acknowledger.queue.empty()
+    [dead_letter] = await state.dead_letters.get("test")
+    assert dead_letter.subject == "poison"
+    assert dead_letter.failures == 2
+    assert state.failures == {"poison": 1}
+    after = REGISTRY.get_sample_value(
+        "graphql_events_dead_lettered_total", {"listener": "test"}
+    )
+    assert (after or 0.0) - (before or 0.0) == 1.0
+    state.dead_letters.close()
+
+
+async def test_deliver_replay_serialized() -> None:
+    app = FastAPI()
+
+    @app.post("/handler")
+    async def handler(event: Event[str]) -> None:
+        raise ValueError("boom")
+
+    state = listener_state(serialize_subjects=True, dead_letter_threshold=1)
+    state.dead_letters = DeadLetterStore()
+    state.shards.append(asyncio.Queue())
+    event = FetchEventEventFetch(subject="a", priority=10000, token=None)
+
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app, raise_app_exceptions=False),
+        base_url="http://fastramqpi",
+    ) as integration_client:
+        replaying = asyncio.create_task(
+            deliver_replay(
+                integration_client=integration_client,
+                state=state,
+                event=event,
+                request_id="replay-a",
+                log=structlog.stdlib.get_logger(),
+            )
+        )
+        # The replay is delivered in turn with the subject's other events
+        await asyncio.sleep(0)
+        assert state.shards[0].qsize() == 1
+        task = asyncio.create_task(
+            deliverer(
+                integration_client=integration_client,
+                state=state,
+                deliveries=state.shards[0],
+                log=structlog.stdlib.get_logger(),
+            )
+        )
+        assert await asyncio.wait_for(replaying, timeout=5) is False
+        task.cancel()
+
+    # Failed replays are neither dead-lettered nor acknowledged
+    assert state.failures == {}
+    assert await state.dead_letters.get("test") == []
+    assert state.acknowledger.queue.empty()
+    state.dead_letters.close()
+
+
+@pytest.mark.parametrize("prefetch", [0, 2])
+async def test_fetcher(
+    graphql_client: GraphQLClient,
+    run_fetcher: FetcherRunner,
+    pending: list[dict[str, Any]],
+    acknowledged: list[Any],
+    prefetch: int,
+) -> None:
+    pending.extend(event(str(i)) for i in range(5))
+    app = FastAPI()
+    received = []
+    stop = asyncio.Event()
+
+    @app.post("/handler")
+    async def event_handler(event: Event[str]) -> None:
+        received.append(event.subject)
+        if len(received) == 3:
+            stop.set()
+
+    state = listener_state(graphql_client, prefetch=prefetch)
+    await run_fetcher(app, state, stop)
+
+    # Events are delivered in the order they were fetched. Everything fetched
+    # before stopping is delivered and acknowledged.
+    fetched = 5 - len(pending)
+    assert fetched >= 3
+    assert received == [str(i) for i in range(fetched)]
+    assert acknowledged == [f"token-{i}" for i in range(fetched)]
+    assert state.stats.hits == fetched
+
+
+async def test_fetcher_stop_during_empty_fetch(
+    run_fetcher: FetcherRunner, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    stop = asyncio.Event()
+
+    async def empty_fetch(*args: Any) -> list[FetchEventEventFetch]:
+        stop.set()
+        await asyncio.sleep(0)
+        return []
+
+    monkeypatch.setattr("fastramqpi.events.fetch_events", empty_fetch)
+    state = listener_state()
+    state.backoff = IdleBackoff(minimum=60, maximum=60)
+
+    # The fetcher stops promptly instead of probing for events until OS2mo
+    # has some.
+    start = time.monotonic()
+    await run_fetcher(FastAPI(), state, stop)
+    assert time.monotonic() - start < 1
+
+
+async def test_fetcher_coalesce(
+    graphql_client: GraphQLClient,
+    run_fetcher: FetcherRunner,
+    pending: list[dict[str, Any]],
+    acknowledged: list[Any],
+) -> None:
+    pending.extend(
+        {"subject": subject, "priority": 10000, "token": token}
+        for subject, token in [("a", 1), ("a", 2), ("a", 3), ("b", 4), ("a", 5)]
+    )
+    app = FastAPI()
+    received = []
+    stop = asyncio.Event()
+
+    @app.post("/handler")
+    async def event_handler(event: Event[str]) -> None:
+        received.append(event.subject)
+        if event.subject == "b":
+            stop.set()
+
+    # All events are fetched, and coalesced, in a single batch before the
+    # first one is delivered.
+    state = listener_state(graphql_client, batch_size=5, prefetch=5, coalesce=True)
+    await run_fetcher(app, state, stop)
+
+    assert received == ["a", "b"]
+    assert sorted(acknowledged) == [1, 2, 3, 4, 5]
+    assert state.pending == {}
+
+
+def test_shard() -> None:
+    assert shard("a", 4) == shard("a", 4)
+    assert {shard(str(i), 4) for i in range(100)} == {0, 1, 2, 3}
+
+
+async def test_fetcher_serialize_subjects(
+    graphql_client: GraphQLClient,
+    run_fetcher: FetcherRunner,
+    pending: list[dict[str, Any]],
+) -> None:
+    # Subjects on different shards
+    a, b = "a", next(s for s in "bcdefgh" if shard(s, 2) != shard("a", 2))
+    pending.extend(
+        {"subject": subject, "priority": 10000, "token": token}
+        for token, subject in enumerate([a, a, b, a, b])
+    )
+    app = FastAPI()
+    active: set[str] = set()
+    overlapped = False
+    received: list[str] = []
+    stop = asyncio.Event()
+
+    @app.post("/handler")
+    async def event_handler(event: Event[str]) -> None:
+        nonlocal overlapped
+        assert event.subject not in active
+        active.add(event.subject)
+        overlapped |= len(active) > 1
+        await asyncio.sleep(0.01)
+        active.remove(event.subject)
+        received.append(event.subject)
+        if len(received) == 5:
+            stop.set()
+
+    state = listener_state(graphql_client, prefetch=5, serialize_subjects=True)
+    state.shards = [asyncio.Queue(), asyncio.Queue()]
+    await run_fetcher(app, state, stop)
+
+    # Distinct subjects are delivered concurrently, but each subject is
+    # delivered one event at a time.
+    assert overlapped
+    assert sorted(received) == sorted([a, a, b, a, b])
+
+
+async def test_fetcher_stop_ignores_siblings(
+    graphql_client: GraphQLClient,
+    run_fetcher: FetcherRunner,
+    pending: list[dict[str, Any]],
+    acknowledged: list[Any],
+) -> None:
+    pending.append(event("a"))
+    app = FastAPI()
+    stop = asyncio.Event()
+
+    @app.post("/handler")
+    async def event_handler(event: Event[str]) -> None:
+        if event.subject == "a":
+            stop.set()
+        await asyncio.sleep(0.01)
+
+    state = listener_state(graphql_client, serialize_subjects=True)
+    state.shards = [asyncio.Queue()]
+
+    async def sibling() -> None:
+        # Another fetcher of the listener, keeping the shared shard deliverer
+        # and acknowledger busy.
+        for i in count():
+            await state.shards[0].put(
+                FetchEventEventFetch(subject="b", priority=10000, token=f"b{i}")
+            )
+            await asyncio.sleep(0.005)
+
+    siblings = asyncio.create_task(sibling())
+    start = time.monotonic()
+    await run_fetcher(app, state, stop)
+    siblings.cancel()
+
+    # The fetcher stops once its own event is acknowledged, although the
+    # shard deliverer and the acknowledger never run out of work.
+    assert time.monotonic() - start < 2
+    assert "token-a" in acknowledged
+
+
+def test_autoscaler_scale_to() -> None:
+    started = []
+    autoscaler = Autoscaler(
+        state=listener_state(),
+        start_fetcher=lambda n, stop: started.append((n, stop)),
+    )
+    autoscaler.scale_to(3)
+    assert [n for n, _ in started] == [0, 1, 2]
+    assert autoscaler.scale == 3
+    autoscaler.scale_to(1)
+    assert autoscaler.scale == 1
+    assert [stop.is_set() for _, stop in started] == [False, True, True]
+
+
+@pytest.mark.parametrize(
+    "stats,expected",
+    [
+        # Backlog
+        (FetcherStats(fetches=10, hits=10, deliveries=10, delivery_seconds=1), 5),
+        # Idle
+        (FetcherStats(fetches=10, hits=1, deliveries=1, delivery_seconds=0.1), 3),
+        # Neither
+        (FetcherStats(fetches=10, hits=7, deliveries=7, delivery_seconds=0.7), 4),
+        # Rate-limited
+        (
+            FetcherStats(
+                fetches=10, hits=10, deliveries=10, delivery_seconds=1, rate_limits=1
+            ),
+            2,
+        ),
+        # Saturated
+        (FetcherStats(fetches=10, hits=10, deliveries=10, delivery_seconds=5), 3),
+    ],
+)
+def test_autoscaler_decide(stats: FetcherStats, expected: int) -> None:
+    autoscaler = Autoscaler(
+        state=listener_state(parallelism=2, max_parallelism=8),
+        start_fetcher=lambda n, stop: None,
+    )
+    autoscaler.scale_to(4)
+    autoscaler.baseline_latency = 0.1
+    assert autoscaler.decide(stats) == expected
+
+
+def test_autoscaler_decide_bounds() -> None:
+    autoscaler = Autoscaler(
+        state=listener_state(parallelism=2, max_parallelism=3),
+        start_fetcher=lambda n, stop: None,
+    )
+    autoscaler.scale_to(3)
+    assert autoscaler.decide(FetcherStats(fetches=10, hits=10)) == 3
+    autoscaler.scale_to(2)
+    assert autoscaler.decide(FetcherStats(fetches=10, hits=0)) == 2
+    assert autoscaler.decide(FetcherStats(rate_limits=1)) == 2
+
+
+@pytest.mark.parametrize(
+    "graphql_handler",
+    [lambda payload: {f"a{i}": True for i in range(len(payload["variables"]))}],
+)
+async def test_acknowledger_flushes_on_size(
+    graphql_client: GraphQLClient, graphql_requests: list[dict[str, Any]]
+) -> None:
+    acknowledger = Acknowledger(graphql_client, max_size=3, interval=60)
+    task = asyncio.create_task(acknowledger.run())
+    for token in "abcdefg":
+        acknowledger.put(token)
+    # Full batches are flushed without waiting for the interval
+    while len(graphql_requests) < 2:
+        await asyncio.sleep(0.01)
+    assert [list(r["variables"].values()) for r in graphql_requests] == [
+        ["a", "b", "c"],
+        ["d", "e", "f"],
+    ]
+    task.cancel()
+    await acknowledger.close()
+    assert list(graphql_requests[-1]["variables"].values()) == ["g"]
+
+
+@pytest.mark.parametrize(
+    "graphql_handler",
+    [lambda payload: {f"a{i}": True for i in range(len(payload["variables"]))}],
+)
+async def test_acknowledger_flushes_on_interval(
+    graphql_client: GraphQLClient, graphql_requests: list[dict[str, Any]]
+) -> None:
+    acknowledger = Acknowledger(graphql_client, max_size=100, interval=0.01)
+    task = asyncio.create_task(acknowledger.run())
+    acknowledger.put("a")
+    acknowledger.put("b")
+    await asyncio.wait_for(acknowledger.queue.join(), timeout=1)
+    assert [list(r["variables"].values()) for r in graphql_requests] == [["a", "b"]]
+    task.cancel()
+
+
+@pytest.mark.parametrize(
+    "graphql_handler",
+    [lambda payload: {"event_acknowledge": True}],
+)
+async def test_acknowledger_join_flushes_immediately(
+    graphql_client: GraphQLClient, graphql_requests: list[dict[str, Any]]
+) -> None:
+    acknowledger = Acknowledger(graphql_client, max_size=100, interval=60)
+    task = asyncio.create_task(acknowledger.run())
+    acknowledger.put("a")
+    await asyncio.sleep(0)
+    await asyncio.wait_for(acknowledger.join(), timeout=1)
+    assert graphql_requests[0]["variables"] == {"token": "a"}
+    task.cancel()
+
+
+@pytest.mark.parametrize(
+    "graphql_handler",
+    [lambda payload: {"event_acknowledge": True}],
+)
+async def test_acknowledger_wait_ignores_other_tokens(
+    graphql_client: GraphQLClient,
+) -> None:
+    acknowledger = Acknowledger(graphql_client, max_size=100, interval=60)
+    acknowledger.put("a")
+    acknowledger.put("b")
+    waiting = asyncio.create_task(acknowledger.wait(["a"]))
+    await asyncio.sleep(0)
+    assert not waiting.done()
+    assert acknowledger.flush_requested.is_set()
+    # Flushing "a" is enough, even though "b", scheduled by another fetcher,
+    # is still waiting to be flushed.
+    await acknowledger._acknowledge(acknowledger._take(1))
+    await asyncio.wait_for(waiting, timeout=1)
+    assert list(acknowledger.flushed) == ["b"]
+    assert acknowledger.queue.qsize() == 1
+
+
+def test_parse_retry_after() -> None:
+    assert parse_retry_after("5") == 5.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    future = format_datetime(datetime.now(timezone.utc) + timedelta(minutes=1))
+    delay = parse_retry_after(future)
+    assert delay is not None
+    assert 55 < delay <= 60
+    assert parse_retry_after("soon") is None
+
+
+async def test_rate_limiter_coalesces_pauses() -> None:
+    rate_limiter = RateLimiter()
+    assert rate_limiter.pause(0.05) > 0
+    # A shorter pause is contained in the current one
+    assert rate_limiter.pause(0.01) == 0.0
+    # A longer pause extends the current one
+    assert 0 < rate_limiter.pause(0.1) < 0.1
+    assert not rate_limiter.allowed.is_set()
+    start = time.monotonic()
+    await asyncio.wait_for(rate_limiter.acquire(), timeout=1)
+    assert time.monotonic() - start >= 0.09
+
+
+async def test_rate_limiter_token_bucket() -> None:
+    rate_limiter = RateLimiter(rate=100)
+    # A second's worth of tokens is available immediately
+    start = time.monotonic()
+    for _ in range(100):
+        await rate_limiter.acquire()
+    assert time.monotonic() - start < 0.05
+    # After which deliveries are paced
+    start = time.monotonic()
+    for _ in range(5):
+        await rate_limiter.acquire()
+    assert time.monotonic() - start >= 0.04
+
+
+async def test_delivery_scheduler_unlimited() -> None:
+    scheduler = DeliveryScheduler()
+    listener = listener_state().listener
+    async with scheduler.slot(listener, 1), scheduler.slot(listener, 1):
+        pass
+
+
+async def test_delivery_scheduler_priority_and_weight() -> None:
+    scheduler = DeliveryScheduler(capacity=1)
+    bulk = Listener(namespace="mo", user_key="bulk", routing_key="class", path="/bulk")
+    employee = Listener(
+        namespace="mo",
+        user_key="employee",
+        routing_key="person",
+        path="/employee",
+        weight=2,
+    )
+    order: list[tuple[str, int]] = []
+
+    async def deliver(listener: Listener, priority: int) -> None:
+        async with scheduler.slot(listener, priority):
+            order.append((listener.user_key, priority))
+            await asyncio.sleep(0)
+
+    async with asyncio.TaskGroup() as tg:
+        # Occupy the only slot while the others queue up
+        async with scheduler.slot(bulk, 10000):
+            for _ in range(4):
+                tg.create_task(deliver(bulk, 10000))
+            for _ in range(4):
+                tg.create_task(deliver(employee, 10000))
+            tg.create_task(deliver(bulk, 1))
+            await asyncio.sleep(0)
+
+    assert order == [
+        ("bulk", 1),
+        ("employee", 10000),
+        ("bulk", 10000),
+        ("employee", 10000),
+        ("employee", 10000),
+        ("bulk", 10000),
+        ("employee", 10000),
+        ("bulk", 10000),
+        ("bulk", 10000),
+    ]
+    assert scheduler.running == 0
+
+
+async def test_lifespan_declares_concurrently(settings: Settings) -> None:
+    log: list[tuple[str, str]] = []
+
+    class RecordingMO(FakeMO):
+        async def handle(self, request: httpx.Request) -> httpx.Response:
+            declared = json.loads(request.content)["variables"].get("input")
+            if declared is None:
+                return await super().handle(request)
+            name = declared.get("user_key") or declared["name"]
+            log.append(("start", name))
+            response = await super().handle(request)
+            log.append(("end", name))
+            return response
+
+    events = GraphQLEvents(
+        declare_namespaces=[Namespace(name="ours")],
+        declare_listeners=[
+            Listener(namespace="ours", user_key="a", routing_key="a", path="/a"),
+            Listener(namespace="ours", user_key="b", routing_key="b", path="/b"),
+            Listener(namespace="mo", user_key="c", routing_key="c", path="/c"),
+        ],
+    )
+    fake = RecordingMO(latency=0.01)
+    async with lifespan(settings, fake.client(), events, FastAPI()):
+        pass
+
+    # Listeners wait for their own namespace only
+    assert log[:2] == [("start", "ours"), ("start", "c")]
+    assert log.index(("end", "ours")) < log.index(("start", "a"))
+    # Listeners are declared concurrently
+    assert log.index(("start", "b")) < log.index(("end", "a"))
+
+
+async def test_lifespan_drains_on_shutdown(settings: Settings) -> None:
+    app = FastAPI()
+    started = asyncio.Event()
+    handled = []
+
+    @app.post("/handler")
+    async def event_handler(event: Event[str]) -> None:
+        started.set()
+        await asyncio.sleep(0.05)
+        handled.append(event.subject)
+
+    events = GraphQLEvents(
+        declare_listeners=[
+            Listener(namespace="mo", user_key="a", routing_key="a", path="/handler"),
+        ],
+        in_process_dispatch=True,
+    )
+    fake = FakeMO(backlog=1)
+    async with lifespan(settings, fake.client(), events, app):
+        await asyncio.wait_for(started.wait(), timeout=5)
+
+    # The delivery in progress at shutdown was finished and acknowledged
+    assert len(handled) == 1
+    assert fake.acknowledged == 1
+
+
+async def test_lifespan_shutdown_during_poll(settings: Settings) -> None:
+    events = GraphQLEvents(
+        declare_listeners=[
+            Listener(namespace="mo", user_key="a", routing_key="a", path="/handler"),
+        ],
+        in_process_dispatch=True,
+    )
+    fake = FakeMO(latency=0.05)
+    async with lifespan(settings, fake.client(), events, FastAPI()):
+        # The listener has been declared, and the first poll is in flight
+        while fake.requests < 2:
+            await asyncio.sleep(0.01)
+        start = time.monotonic()
+
+    # Shutting down with an empty poll in flight does not wait for the drain
+    # timeout.
+    assert time.monotonic() - start < 2
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"batch_size": 0},
+        {"prefetch": -1},
+        {"min_idle_sleep": -1},
+        {"min_idle_sleep": 2, "max_idle_sleep": 1},
+        {"acknowledge_batch_size": 0},
+        {"acknowledge_interval": -1},
+        {"parallelism": 2, "max_parallelism": 1},
+        {"max_events_per_second": 0},
+        {"weight": 0},
+        {"dead_letter_threshold": 0},
+    ],
+)
+def test_listener_validation(kwargs: dict[str, Any]) -> None:
+    with pytest.raises(ValueError):
+        Listener(namespace="mo", user_key="a", routing_key="a", path="/a", **kwargs)
+
+
+@pytest.mark.parametrize(
+    "kwargs", [{"max_concurrent_deliveries": 0}, {"drain_timeout": -1}]
+)
+def test_graphql_events_validation(kwargs: dict[str, Any]) -> None:
+    with pytest.raises(ValueError):
+        GraphQLEvents(**kwargs)
+
+
+async def test_lifespan_requires_dead_letter_database(settings: Settings) -> None:
+    events = GraphQLEvents(
+        declare_listeners=[
+            Listener(
+                namespace="mo",
+                user_key="a",
+                routing_key="a",
+                path="/handler",
+                dead_letter_threshold=3,
+            ),
+        ],
+    )
+    mo_client = httpx.AsyncClient()
+    with pytest.raises(ValueError, match="dead_letter_database"):
+        async with lifespan(settings, mo_client, events, FastAPI()):
+            pass  # pragma: no cover
+
+
+def test_pool_size() -> None:
+    def listener(**kwargs: Any) -> Listener:
+        return Listener(
+            namespace="mo", user_key="a", routing_key="a", path="/a", **kwargs
+        )
+
+    assert pool_size(GraphQLEvents()) == 1
+    listeners = [listener(parallelism=2), listener(parallelism=2, max_parallelism=8)]
+    assert pool_size(GraphQLEvents(declare_listeners=listeners)) == 10
+    assert (
+        pool_size(
+            GraphQLEvents(declare_listeners=listeners, max_concurrent_deliveries=4)
+        )
+        == 4
+    )
+
+
+async def test_pool_wait_trace() -> None:
+    def observations() -> float:
+        value = REGISTRY.get_sample_value(
+            "graphql_events_deliver_pool_wait_seconds_count", {"listener": "trace"}
+        )
+        return value or 0.0
+
+    before = observations()
+    trace = pool_wait_trace("trace")
+    await trace("connection.connect_tcp.started", {})
+    await trace("connection.connect_tcp.complete", {})
+    await trace("http11.send_request_headers.started", {})
+    # Only the wait before the first event is observed
+    assert observations() - before == 1
@@ -0,0 +1,78 @@
+# SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+import asyncio
+
+from fastapi import FastAPI
+
+from fastramqpi.autogenerated_graphql_client import GraphQLClient
+from fastramqpi.autogenerated_graphql_client import ListenerCreateInput
+from fastramqpi.autogenerated_graphql_client import NamespaceCreateInput
+from fastramqpi.config import Settings
+from fastramqpi.events import Event
+from fastramqpi.events import GraphQLEvents
+from fastramqpi.events import Listener
+from fastramqpi.events import acknowledge_events
+from fastramqpi.events import fetch_events
+from fastramqpi.events import lifespan
+from fastramqpi.events_fake import FakeMO
+
+
+async def test_fake_mo() -> None:
+    fake = FakeMO(retry_delay=0.5)
+    async with GraphQLClient(
+        url="http://mo/graphql/v25", http_client=fake.client()
+    ) as graphql_client:
+        await graphql_client.declare_event_namespace(
+            input=NamespaceCreateInput(name="ours")
+        )
+        listener = await graphql_client.declare_event_listener(
+            input=ListenerCreateInput(namespace="ours", user_key="a", routing_key="r")
+        )
+        fake.send("ours", "r", "low", priority=2)
+        fake.send("ours", "r", "high", priority=1)
+        fake.send("ours", "other", "unbound")
+
+        events = await fetch_events(graphql_client, listener.uuid, 3)
+        assert [event.subject for event in events] == ["high", "low"]
+        await acknowledge_events(graphql_client, [events[0].token])
+        assert await fetch_events(graphql_client, listener.uuid, 1) == []
+
+        # Unacknowledged events are fetched again after the retry delay
+        await asyncio.sleep(0.5)
+        [event] = await fetch_events(graphql_client, listener.uuid, 1)
+        assert event.subject == "low"
+        assert event.token != events[1].token
+
+    assert fake.fetched == 3
+    assert fake.acknowledged == 1
+    assert fake.unacknowledged() == 1
+
+
+async def test_fake_mo_lifespan(settings: Settings) -> None:
+    fake = FakeMO(latency=0.001, backlog=50)
+    app = FastAPI()
+    received = []
+
+    @app.post("/handler")
+    async def handler(event: Event[str]) -> None:
+        received.append(event.subject)
+
+    events = GraphQLEvents(
+        declare_listeners=[
+            Listener(
+                namespace="mo",
+                user_key="a",
+                routing_key="r",
+                path="/handler",
+                parallelism=4,
+                batch_size=5,
+            ),
+        ],
+        in_process_dispatch=True,
+    )
+    async with lifespan(settings, fake.client(), events, app):
+        while fake.unacknowledged():
+            await asyncio.sleep(0.01)
+
+    assert len(set(received)) == 50
+    assert fake.acknowledged == 50
@@ -0,0 +1,278 @@
+# SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+import asyncio
+from datetime import datetime
+from datetime import timezone
+from pathlib import Path
+from typing import Any
+from uuid import uuid4
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+from fastapi import HTTPException
+
+from fastramqpi.autogenerated_graphql_client import GraphQLClient
+from fastramqpi.config import Settings
+from fastramqpi.events import Acknowledger
+from fastramqpi.events import DeadLetter
+from fastramqpi.events import Event
+from fastramqpi.events import GraphQLEvents
+from fastramqpi.events import IdleBackoff
+from fastramqpi.events import Listener
+from fastramqpi.events import ListenerState
+from fastramqpi.events import lifespan
+from fastramqpi.events_fake import FakeMO
+from fastramqpi.events_replay import ReplayProgress
+from fastramqpi.events_replay import ReplayRequest
+from fastramqpi.events_replay import replay
+from fastramqpi.events_replay import router
+
+SUBJECTS = [str(uuid4()) for _ in range(5)]
+
+
+def fake_mo() -> FakeMO:
+    """OS2mo with five employees, and no events."""
+    return FakeMO(collections={"employees": SUBJECTS})
+
+
+def integration(received: list[str]) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/handler")
+    async def handler(event: Event[str]) -> None:
+        received.append(event.subject)
+        if event.subject == SUBJECTS[3]:
+            raise HTTPException(status_code=500)
+
+    return app
+
+
+async def test_replay() -> None:
+    received: list[str] = []
+    progress = ReplayProgress(
+        request=ReplayRequest(collection="employees", page_size=2, parallelism=2)
+    )
+    async with (
+        GraphQLClient(
+            url="http://mo/graphql/v25",
+            http_client=fake_mo().client(),
+        ) as graphql_client,
+        httpx.AsyncClient(
+            transport=httpx.ASGITransport(
+                app=integration(received), raise_app_exceptions=False
+            ),
+            base_url="http://fastramqpi",
+        ) as integration_client,
+    ):
+        state = ListenerState(
+            listener=Listener(
+                namespace="mo",
+                user_key="test",
+                routing_key="person",
+                path="/handler",
+                dead_letter_threshold=1,
+            ),
+            uuid=uuid4(),
+            backoff=IdleBackoff(minimum=0.01, maximum=0.01),
+            acknowledger=Acknowledger(graphql_client, max_size=1, interval=0),
+        )
+        await replay(graphql_client, integration_client, state, progress)
+
+    assert sorted(received) == sorted(SUBJECTS)
+    assert progress.done
+    assert progress.pages == 3
+    assert progress.cursor == "4"
+    assert progress.delivered == 4
+    # Failed replays do not count towards dead-lettering
+    assert state.failures == {}
+    assert progress.failed == [SUBJECTS[3]]
+
+
+async def test_replay_api(settings: Settings) -> None:
+    received: list[str] = []
+    app = integration(received)
+    app.include_router(router)
+    events = GraphQLEvents(
+        declare_listeners=[
+            Listener(
+                namespace="mo", user_key="test", routing_key="person", path="/handler"
+            ),
+        ],
+        in_process_dispatch=True,
+    )
+    mo_client = fake_mo().client()
+    async with (
+        lifespan(settings, mo_client, events, app),
+        httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://fastramqpi"
+        ) as client,
+    ):
+        r = await client.get("/graphql-events/listeners/test/replay")
+        assert r.status_code == 404
+
+        # Resume from the second page
+        r = await client.post(
+            "/graphql-events/listeners/test/replay",
+            json={"collection": "employees", "page_size": 2, "cursor": "2"},
+        )
+        assert r.status_code == 202
+
+        async def done() -> dict[str, Any]:
+            while True:
+                r = await client.get("/graphql-events/listeners/test/replay")
+                progress: dict[str, Any] = r.json()
+                if progress["done"]:
+                    return progress
+                await asyncio.sleep(0.01)
+
+        progress = await asyncio.wait_for(done(), timeout=5)
+
+        for invalid in [
+            {"collection": "employees { uuid } classes"},
+            {"collection": "employees", "page_size": 0},
+            {"collection": "employees", "parallelism": 0},
+            {"collection": "employees", "rate": 0},
+        ]:
+            r = await client.post("/graphql-events/listeners/test/replay", json=invalid)
+            assert r.status_code == 422
+
+        # The listener does not dead-letter events
+        r = await client.get("/graphql-events/listeners/test/dead-letters")
+        assert r.status_code == 404
+
+        r = await client.post(
+            "/graphql-events/listeners/unknown/replay",
+            json={"collection": "employees"},
+        )
+        assert r.status_code == 404
+
+    assert received == SUBJECTS[2:]
+    assert progress["delivered"] == 2
+    assert progress["failed"] == [SUBJECTS[3]]
+
+
+async def test_dead_letters_api(settings: Settings, tmp_path: Path) -> None:
+    received: list[str] = []
+    app = integration(received)
+    app.include_router(router)
+    events = GraphQLEvents(
+        declare_listeners=[
+            Listener(
+                namespace="mo",
+                user_key="test",
+                routing_key="person",
+                path="/handler",
+                dead_letter_threshold=3,
+                serialize_subjects=True,
+            ),
+        ],
+        in_process_dispatch=True,
+        dead_letter_database=str(tmp_path / "dead-letters.db"),
+    )
+    mo_client = fake_mo().client()
+    async with (
+        lifespan(settings, mo_client, events, app),
+        httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://fastramqpi"
+        ) as client,
+    ):
+        dead_letters = app.state.graphql_events.states["test"].dead_letters
+        for subject in SUBJECTS[2:5]:
+            await dead_letters.add(
+                DeadLetter(
+                    listener="test",
+                    subject=subject,
+                    priority=10000,
+                    failures=3,
+                    dead_lettered_at=datetime.now(timezone.utc),
+                )
+            )
+
+        r = await client.get("/graphql-events/listeners/test/dead-letters")
+        assert [d["subject"] for d in r.json()] == SUBJECTS[2:5]
+
+        r = await client.post(
+            "/graphql-events/listeners/test/dead-letters/replay",
+            params={"subject": SUBJECTS[2]},
+        )
+        assert r.json() == {"delivered": [SUBJECTS[2]], "failed": []}
+
+        r = await client.post("/graphql-events/listeners/test/dead-letters/replay")
+        assert r.json() == {"delivered": [SUBJECTS[4]], "failed": [SUBJECTS[3]]}
+
+        r = await client.get("/graphql-events/listeners/test/dead-letters")
+        assert [d["subject"] for d in r.json()] == [SUBJECTS[3]]
+
+        r = await client.get("/graphql-events/listeners/unknown/dead-letters")
+        assert r.status_code == 404
+
+    assert received == [SUBJECTS[2], SUBJECTS[3], SUBJECTS[4]]
+
+
+async def test_replay_alongside_deliveries(settings: Settings, tmp_path: Path) -> None:
+    app = FastAPI()
+    app.include_router(router)
+    replayed: list[str] = []
+    replaying = 0
+    concurrent = 0
+
+    @app.post("/handler")
+    async def handler(event: Event[str]) -> None:
+        nonlocal replaying, concurrent
+        if event.subject not in SUBJECTS:
+            # The listener's only connection is held by a live delivery until
+            # the replay is done.
+            while len(replayed) < len(SUBJECTS):
+                await asyncio.sleep(0.01)
+            return
+        replaying += 1
+        concurrent = max(concurrent, replaying)
+        await asyncio.sleep(0.05)
+        replaying -= 1
+        replayed.append(event.subject)
+
+    socket = str(tmp_path / "integration.sock")
+    server = uvicorn.Server(
+        uvicorn.Config(app, uds=socket, lifespan="off", log_level="warning")
+    )
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    fake = FakeMO(backlog=1, collections={"employees": SUBJECTS})
+    events = GraphQLEvents(
+        declare_listeners=[
+            Listener(
+                namespace="mo", user_key="test", routing_key="person", path="/handler"
+            ),
+        ],
+        integration_uds=socket,
+    )
+    async with (
+        lifespan(settings, fake.client(), events, app),
+        httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://fastramqpi"
+        ) as client,
+    ):
+        while not fake.fetched:
+            await asyncio.sleep(0.01)
+        r = await client.post(
+            "/graphql-events/listeners/test/replay",
+            json={"collection": "employees", "parallelism": 4},
+        )
+        assert r.status_code == 202
+
+        async def acknowledged() -> None:
+            while not fake.acknowledged:
+                await asyncio.sleep(0.01)
+
+        await asyncio.wait_for(acknowledged(), timeout=5)
+
+    server.should_exit = True
+    await serving
+
+    # The replay used connections of its own, in parallel, while the live
+    # delivery held the listener's connection.
+    assert sorted(replayed) == sorted(SUBJECTS)
+    assert concurrent == 4
@@ -14,18 +14,25 @@ from typing import Any
 
 import pytest
 from fastapi import Depends
+from fastapi import FastAPI
+from fastapi import Request
+from fastapi.dependencies.utils import get_dependant
 from pydantic import BaseModel
 
 from fastramqpi.ramqp import AMQPSystem
 from fastramqpi.ramqp.depends import Context
 from fastramqpi.ramqp.depends import Message
 from fastramqpi.ramqp.depends import RoutingKey
+from fastramqpi.ramqp.depends import UnsupportedDependency
+from fastramqpi.ramqp.depends import compile_plan
 from fastramqpi.ramqp.depends import dependency_injected
 from fastramqpi.ramqp.depends import dependency_injected_with_deps
 from fastramqpi.ramqp.depends import from_context
 from fastramqpi.ramqp.depends import get_message
 from fastramqpi.ramqp.depends import get_payload_as_type
 from fastramqpi.ramqp.depends import get_payload_bytes
+from fastramqpi.ramqp.depends import get_routing_key
+from fastramqpi.ramqp.depends import get_state
 from fastramqpi.ramqp.depends import handle_exclusively
 from fastramqpi.ramqp.depends import handle_exclusively_decorator
 from fastramqpi.ramqp.depends import rate_limit
@@ -520,3 +527,71 @@ async def test_dependency_injected_deps() -> None:
         "agenerator_before": 1,
         "agenerator_after": 1,
     }
+
+
+async def test_compile_plan() -> None:
+    """Test that the dependency graph is compiled into a flat plan."""
+
+    def sync_dependency(message: Message) -> str:
+        return "sync"
+
+    async def handler(
+        routing_key: RoutingKey,
+        message: Message,
+        value: Annotated[str, Depends(sync_dependency)],
+    ) -> None:
+        pass
+
+    plan = compile_plan(get_dependant(path="", call=handler), overrides={})
+    # get_state, get_message, and get_routing_key are only resolved once
+    assert [step.call for step in plan.steps] == [
+        get_state,
+        get_message,
+        get_routing_key,
+        sync_dependency,
+    ]
+    assert [step.kind for step in plan.steps] == ["state", "inline", "inline", "thread"]
+    assert plan.arguments == (("routing_key", 2), ("message", 1), ("value", 3))
+
+
+async def test_dependency_injected_overrides() -> None:
+    """Test that dependency overrides of the FastAPI app are respected."""
+
+    def original() -> str:
+        return "original"
+
+    def override(routing_key: RoutingKey) -> str:
+        return f"override-{routing_key}"
+
+    @dependency_injected
+    async def handler(value: Annotated[str, Depends(original)]) -> str:
+        return value
+
+    message = payload2incoming({"hello": "world"})
+    app = FastAPI()
+    context = {"app": app}
+    assert await handler(message=message, context=context) == "original"
+    app.dependency_overrides[original] = override
+    assert (
+        await handler(message=message, context=context) == "override-test.routing.key"
+    )
+    app.dependency_overrides.clear()
+    assert await handler(message=message, context=context) == "original"
+
+
+async def test_dependency_injected_request_fallback() -> None:
+    """Test that dependencies on the Request are resolved through FastAPI."""
+
+    def get_message_from_request(request: Request) -> Any:
+        return request.state.message
+
+    async def callback(
+        value: Annotated[Any, Depends(get_message_from_request)],
+    ) -> Any:
+        return value
+
+    with pytest.raises(UnsupportedDependency):
+        compile_plan(get_dependant(path="", call=callback), overrides={})
+    message = payload2incoming({"hello": "world"})
+    handler = dependency_injected(callback)
+    assert await handler(message=message, context={}) is message
@@ -113,3 +113,20 @@ def test_register_dependencies(amqp_system: AMQPSystem) -> None:
     assert getattr(callback_func3, "dependencies", []) == dependencies
 
     assert get_registry(amqp_system) == {callback_func3: {"test.routing.key"}}
+
+
+def test_register_prefetch(amqp_system: AMQPSystem) -> None:
+    """Test that callbacks can be registered with their own prefetch."""
+    amqp_system.router.register("test.routing.key")(callback_func1)
+    amqp_system.router.register("test.routing.key", prefetch=2)(callback_func2)
+    amqp_system.router.register("test.routing.key2")(callback_func2)
+
+    assert get_registry(amqp_system) == {
+        callback_func1: {"test.routing.key"},
+        callback_func2: {"test.routing.key", "test.routing.key2"},
+    }
+    assert amqp_system.router.prefetch == {callback_func2: 2}
+
+    # A prefetch of zero would be unlimited
+    with pytest.raises(AssertionError):
+        amqp_system.router.register("test.routing.key", prefetch=0)(callback_func1)